@@ -0,0 +1,80 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager, I, get_gate_table
+from app.OpcodeGrid import OP_I, OP_C, IsGateOp
+from app.Profiler import PROFILER
+from app.PeepholeOptimizer import PeepholeOptimizer
+
+# fused single-qubit gates are grouped into matrices on up to this many wires
+LAYER_GROUP_QBIT = 2
+
+""" program example
+("layer", [((0, 2), U), ((3,), V)])   disjoint uncontrolled matrices, one pass each group
+("line",  line)                       opcode line with controls or packs, applied as-is
+"""
+
+class CircuitCompiler:
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+        self.optimizer = PeepholeOptimizer(cm)
+        # pack_key -> (circuit hash, dtype, program)
+        self.programs: dict[str, tuple[str, np.dtype, list]] = {}
+
+    def Compile(self, pack_key = "") -> list:
+        circuit_hash = self.cm.GetCircuitHash(pack_key)
+        cached = self.programs.get(pack_key)
+        if cached is not None and cached[:2] == (circuit_hash, self.cm.dtype):
+            PROFILER.Count("cache.program.hit")
+            return cached[2]
+
+        PROFILER.Count("cache.program.miss")
+        with PROFILER.Timer("sim.compile"):
+            program = self.Fuse(self.optimizer.GetOpcodes(pack_key))
+        self.programs[pack_key] = (circuit_hash, self.cm.dtype, program)
+        return program
+
+    def Fuse(self, ops: np.ndarray) -> list:
+        program = []
+        # wire -> product of the uncontrolled single-qubit gates not emitted yet
+        pending: dict[int, np.ndarray] = {}
+        gates = get_gate_table(self.cm.dtype)
+        for line in ops:
+            # program lines are copies, the grid buffer shifts rows on insert/delete
+            if np.any(line == OP_C):
+                self.Flush(program, pending, list(np.flatnonzero(line != OP_I)))
+                program.append(("line", line.copy()))
+                continue
+
+            # single-qubit gates commute with packs on other wires, so keep absorbing them
+            rest = line.copy()
+            for q_idx in np.flatnonzero(IsGateOp(line)):
+                gate = gates[line[q_idx]]
+                pending[q_idx] = np.dot(gate, pending[q_idx]) if q_idx in pending else gate
+                rest[q_idx] = OP_I
+            if np.any(rest != OP_I):
+                self.Flush(program, pending, list(np.flatnonzero(rest != OP_I)))
+                program.append(("line", rest))
+        self.Flush(program, pending, list(pending))
+        return program
+
+    def Flush(self, program: list, pending: dict[int, np.ndarray], wires: list[int]):
+        fused = []
+        for q_idx in wires:
+            if q_idx not in pending:
+                continue
+            gate = pending.pop(q_idx)
+            # e.g. H H or X X
+            if not np.allclose(gate, I, atol=max(1e-8, 16 * np.finfo(gate.dtype).eps)):
+                fused.append((q_idx, gate))
+        if len(fused) == 0:
+            return
+
+        groups = []
+        for i in range(0, len(fused), LAYER_GROUP_QBIT):
+            qbits = tuple(q_idx for q_idx, _ in fused[i:i + LAYER_GROUP_QBIT])
+            matrix = np.ones((1, 1), dtype=self.cm.dtype)
+            for _, gate in fused[i:i + LAYER_GROUP_QBIT]:
+                matrix = np.kron(gate, matrix)
+            groups.append((qbits, matrix))
+        program.append(("layer", groups))
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+
+""" circuit file example
+Each text row is one qubit wire and each column one circuit line, as in the
+grid sketch in CircuitManager.py. Blocks named "<key>:" define packed gates;
+rows before any header (or under "main:") form the main circuit.
+
+# 3-qubit pack
+P0:
+H C
+I X
+I T
+
+main:
+I X I P0 I X
+I I I  1 T C
+I C H  2 C C
+"""
+
+MAIN_CIRCUIT_NAME = "main"
+
+def ParseCircuit(text: str) -> CircuitManager:
+    blocks: dict[str, list[list[str]]] = {}
+    name = MAIN_CIRCUIT_NAME
+    for line_no, raw in enumerate(text.splitlines(), 1):
+        line = raw.split("#")[0].strip()
+        if line == "":
+            continue
+        if line.endswith(":"):
+            name = line[:-1].strip()
+            if name in blocks:
+                raise ValueError(f"line {line_no}: duplicate block '{name}'")
+            blocks[name] = []
+            continue
+
+        blocks.setdefault(name, []).append(line.split())
+
+    if MAIN_CIRCUIT_NAME not in blocks:
+        raise ValueError("missing main circuit")
+
+    cm = CircuitManager({})
+    grids = {}
+    for name, rows in blocks.items():
+        if len(rows) == 0:
+            raise ValueError(f"block '{name}' is empty")
+        if len({len(row) for row in rows}) != 1:
+            raise ValueError(f"block '{name}' has wires of different length")
+        # text rows are wires, grid rows are circuit lines
+        # no fixed width: pack keys such as "P10" are longer than two characters
+        grids[name] = np.array(rows, dtype=str).T
+        if name != MAIN_CIRCUIT_NAME:
+            if name in ("I", "C") or name.isdigit() or cm.IsBaseGate(name):
+                raise ValueError(f"'{name}' can not be used as a pack key")
+            # packs may use packs defined further down
+            cm.AddNewPack(name)
+
+    cm.circuit = grids.pop(MAIN_CIRCUIT_NAME)
+    for name, grid in grids.items():
+        cm.packed_gate[name] = grid
+
+    ValidateCircuit(cm)
+    return cm
+
+def ValidateCircuit(cm: CircuitManager):
+    for pack_key in [""] + list(cm.packed_gate):
+        circuit = cm.GetCircuit(pack_key)
+        for line_idx, line in enumerate(circuit):
+            # wires taken by the digits of a pack above them
+            covered = set()
+            for q_idx, key in enumerate(line):
+                if key != "I" and not key.isdigit() and not cm.IsValidGateKey(key):
+                    raise KeyError(key)
+                if key.isdigit() and q_idx not in covered:
+                    raise ValueError(f"'{key}' at line {line_idx}, q[{q_idx}] "
+                                     f"does not continue a pack above it")
+                if not cm.IsPackedGate(key):
+                    continue
+                size = cm.GetQbitNum(key)
+                expected = [str(i) for i in range(1, size)]
+                if list(line[q_idx + 1:q_idx + size]) != expected:
+                    raise ValueError(f"pack '{key}' at line {line_idx}, q[{q_idx}] "
+                                     f"needs {expected} on the wires below it")
+                covered.update(range(q_idx + 1, q_idx + size))
+
+def FormatCircuit(cm: CircuitManager) -> str:
+    blocks = []
+    for pack_key in list(cm.packed_gate) + [""]:
+        wires = cm.GetCircuit(pack_key).T
+        width = max(len(key) for key in wires.ravel())
+        rows = [" ".join(key.rjust(width) for key in wire) for wire in wires]
+        blocks.append(f"{pack_key or MAIN_CIRCUIT_NAME}:\n" + "\n".join(rows))
+    return "\n\n".join(blocks) + "\n"
+
+def LoadCircuit(path: str) -> CircuitManager:
+    with open(path, encoding="utf-8") as f:
+        return ParseCircuit(f.read())
+
+def SaveCircuit(cm: CircuitManager, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(FormatCircuit(cm))
@@ -1,18 +1,43 @@
+from __future__ import annotations
+import hashlib
+from collections.abc import MutableMapping
 import numpy as np
 
+from app.OpcodeGrid import OpcodeGrid, OpcodeTable, OP_I, OP_C, GATE_BASE, IsDigitOp, IsPackOp, IsTargetOp
+from app.SparseUnitary import SparseUnitary
+from app.Profiler import PROFILER
+
 I = np.array([[1,0],[0,1]], dtype=complex)
 ZERO = np.array([[1, 0], [0, 0]], dtype=complex)  # |0><0| projector
 ONE = np.array([[0, 0], [0, 1]], dtype=complex)   # |1><1| projector
 
 GATES = {
-    "X": np.array([[0,1],[1,0]]),
-    "T": np.array([[1,0],[0, np.exp(complex(0,1)*np.pi/4)]]), # 45
-    "S":np.array([[1,0],[0,complex(0,1)]]), # 90
-    "Z": np.array([[1,0],[0,-1]]), #180
-    "Y": np.array([[0, complex(0,-1)],[complex(0,1),0]]), # 270
-    "H": np.array([[1,1],[1,-1]]) / np.sqrt(2),
+    "X": np.array([[0,1],[1,0]], dtype=complex),
+    "T": np.array([[1,0],[0, np.exp(complex(0,1)*np.pi/4)]], dtype=complex), # 45
+    "S":np.array([[1,0],[0,complex(0,1)]], dtype=complex), # 90
+    "Z": np.array([[1,0],[0,-1]], dtype=complex), #180
+    "Y": np.array([[0, complex(0,-1)],[complex(0,1),0]], dtype=complex), # 270
+    "H": np.array([[1,1],[1,-1]], dtype=complex) / np.sqrt(2),
 }
 
+# complex64 halves memory and bandwidth at ~1e-7 relative precision
+PRECISIONS = (np.dtype(np.complex64), np.dtype(np.complex128))
+
+SPARSE_GATES = {key: SparseUnitary.FromDense(gate) for key, gate in GATES.items()}
+
+# the same tables indexed by opcode
+OP_GATES = {GATE_BASE + i: gate for i, gate in enumerate(GATES.values())}
+OP_SPARSE_GATES = {GATE_BASE + i: gate for i, gate in enumerate(SPARSE_GATES.values())}
+
+gate_tables: dict[np.dtype, dict[int, np.ndarray]] = {}
+
+def get_gate_table(dtype) -> dict[int, np.ndarray]:
+    """OP_GATES cast once to dtype, so products and krons never upcast."""
+    dtype = np.dtype(dtype)
+    if dtype not in gate_tables:
+        gate_tables[dtype] = {op: gate.astype(dtype) for op, gate in OP_GATES.items()}
+    return gate_tables[dtype]
+
 
 """ circuit example
 I X I P0 I X
@@ -32,30 +57,141 @@ def find_power_of_two(n):
         count += 1
     return count
 
+def get_control_indices(qbit_num: int, controls: list[int]) -> np.ndarray:
+    """Basis indices with every control bit set, in ascending order of the remaining bits."""
+    rest = [q_idx for q_idx in range(qbit_num) if q_idx not in controls]
+    sub = np.arange(2**len(rest))
+    idx = np.full(len(sub), sum(1 << q_idx for q_idx in controls))
+    for bit, q_idx in enumerate(rest):
+        idx |= ((sub >> bit) & 1) << q_idx
+    return idx
+
+class PackedGateView(MutableMapping):
+    """String-grid view of the packed gates, kept for code written against dict[str, np.ndarray]."""
+
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+
+    def __getitem__(self, pack_key: str) -> np.ndarray:
+        if pack_key not in self:
+            raise KeyError(pack_key)
+        return self.cm.table.DecodeGrid(self.cm.grids[pack_key].rows)
+
+    def __setitem__(self, pack_key: str, circuit: np.ndarray):
+        self.cm.table.RegisterPack(pack_key)
+        self.cm.grids[pack_key] = OpcodeGrid(self.cm.table.EncodeGrid(circuit))
+        self.cm.Invalidate(pack_key)
+
+    def __delitem__(self, pack_key: str):
+        if pack_key not in self:
+            raise KeyError(pack_key)
+        self.cm.Invalidate(pack_key)
+        del self.cm.grids[pack_key]
+
+    def __contains__(self, pack_key) -> bool:
+        return pack_key != "" and pack_key in self.cm.grids
+
+    def __iter__(self):
+        return (key for key in self.cm.grids if key != "")
+
+    def __len__(self) -> int:
+        return len(self.cm.grids) - 1
+
 class CircuitManager:
     def __init__(self, preset: dict[str, np.ndarray] = {}) -> None:
-        self.packed_gate = preset
-        self.circuit = np.array([["I"]], dtype="U2")
+        self.table = OpcodeTable(list(GATES.keys()))
+        # "" is the main circuit, every other key a packed gate
+        self.grids: dict[str, OpcodeGrid] = {"": OpcodeGrid(np.full((1, 1), OP_I))}
+        self.packed_gate = PackedGateView(self)
 
-    def AddNewPack(self):
-        new_pack_key = f"P{len(self.packed_gate)}"
-        self.packed_gate[new_pack_key] = np.array([["I"]], dtype="U2")
+        # dtype of every state and unitary built for this circuit
+        self.dtype = np.dtype(complex)
+        # compiled pack unitaries, keyed by a content hash so identical packs share one entry
+        self.pack_hash: dict[str, str] = {}
+        self.compiled_pack: dict[str, np.ndarray] = {}
+        self.compiled_sparse_pack: dict[str, SparseUnitary] = {}
 
-    def GetLen(self, pack_key = "") -> int:
+        # register every key first, packs may reference each other in any order
+        for pack_key in preset:
+            self.table.RegisterPack(pack_key)
+        for pack_key, circuit in preset.items():
+            self.packed_gate[pack_key] = circuit
+
+    @property
+    def circuit(self) -> np.ndarray:
+        return self.table.DecodeGrid(self.grids[""].rows)
+
+    @circuit.setter
+    def circuit(self, value: np.ndarray):
+        self.grids[""] = OpcodeGrid(self.table.EncodeGrid(value))
+
+    def Snapshot(self) -> CircuitManager:
+        """Independent copy of the grids; compiled pack caches are content-addressed and shared."""
+        ret = CircuitManager({})
+        ret.table = self.table.Copy()
+        ret.grids = {key: grid.Copy() for key, grid in self.grids.items()}
+        ret.pack_hash = dict(self.pack_hash)
+        ret.dtype = self.dtype
+        ret.compiled_pack = self.compiled_pack
+        ret.compiled_sparse_pack = self.compiled_sparse_pack
+        return ret
+
+    def Restore(self, snapshot: CircuitManager):
+        self.table = snapshot.table
+        self.grids = snapshot.grids
+        self.pack_hash = snapshot.pack_hash
+        self.dtype = snapshot.dtype
+        self.compiled_pack = snapshot.compiled_pack
+        self.compiled_sparse_pack = snapshot.compiled_sparse_pack
+
+    def SetPrecision(self, dtype):
+        """complex64 or complex128; compiled packs are rebuilt in the new dtype."""
+        dtype = np.dtype(dtype)
+        if dtype not in PRECISIONS:
+            raise ValueError(f"unsupported precision {dtype}")
+        if dtype != self.dtype:
+            self.dtype = dtype
+            # new dicts, snapshots taken before keep the old ones
+            self.compiled_pack = {}
+            self.compiled_sparse_pack = {}
+
+    def AddNewPack(self, pack_key = ""):
         if pack_key == "":
-            return len(self.circuit)
-        elif self.IsPackedGate(pack_key):
-            return len(self.packed_gate[pack_key])
+            pack_key = f"P{len(self.packed_gate)}"
+        self.packed_gate[pack_key] = np.array([["I"]], dtype="U2")
+
+    def GetGrid(self, pack_key = "") -> OpcodeGrid:
+        if pack_key == "" or self.IsPackedGate(pack_key):
+            return self.grids[pack_key]
         else:
             raise KeyError(pack_key)
 
+    def GetOpcodes(self, pack_key = "") -> np.ndarray:
+        return self.GetGrid(pack_key).rows
+
+    def GetCircuit(self, pack_key = "") -> np.ndarray:
+        return self.table.DecodeGrid(self.GetOpcodes(pack_key))
+
+    def GetLen(self, pack_key = "") -> int:
+        return len(self.GetGrid(pack_key))
+
     def GetQbitNum(self, pack_key=""):
-        if pack_key == "":
-            return len(self.circuit[0])
-        elif self.IsPackedGate(pack_key):
-            return len(self.packed_gate[pack_key][0])
-        else:
-            raise KeyError(pack_key)
+        return self.GetGrid(pack_key).width
+
+    def GetKey(self, line_idx: int, q_idx: int, pack_key = "") -> str:
+        return self.table.Decode(self.GetOpcodes(pack_key)[line_idx, q_idx])
+
+    def SetKey(self, line_idx: int, q_idx: int, key: str, pack_key = ""):
+        self.GetOpcodes(pack_key)[line_idx, q_idx] = self.table.Encode(key)
+        self.Invalidate(pack_key)
+
+    def InsertLine(self, line_idx: int, pack_key = ""):
+        self.GetGrid(pack_key).InsertRow(line_idx)
+        self.Invalidate(pack_key)
+
+    def DeleteLine(self, line_idx: int, pack_key = ""):
+        self.GetGrid(pack_key).DeleteRow(line_idx)
+        self.Invalidate(pack_key)
 
     def IsBaseGate(self, key: str) -> bool:
         return key in GATES
@@ -70,58 +206,140 @@ class CircuitManager:
             return False
 
     def IsSubQbitValid(self, pack_key = ""):
-        if pack_key == "":
-            return len(self.circuit[0]) > 1 and np.all(self.circuit[:,-1] == "I")
-        elif self.IsPackedGate(pack_key):
-            return len(self.packed_gate[pack_key][0]) > 1 and np.all(self.packed_gate[pack_key][:,-1] == "I")
-        else:
-            raise KeyError(pack_key)
+        ops = self.GetOpcodes(pack_key)
+        return ops.shape[1] > 1 and np.all(ops[:,-1] == OP_I)
 
     def SubQbit(self, pack_key = ""):
-        if pack_key == "":
-            self.circuit = self.circuit[:,:-1]
-        elif self.IsPackedGate(pack_key):
-            self.packed_gate[pack_key] = self.packed_gate[pack_key][:,:-1]
-        else:
-            raise KeyError(pack_key)
+        self.GetGrid(pack_key).SubColumn()
+        self.Invalidate(pack_key)
     
     def AddQbit(self, pack_key = ""):
+        self.GetGrid(pack_key).AddColumn()
+        self.Invalidate(pack_key)
+
+    def GetPackKey(self, op) -> str:
+        return self.table.Decode(op)
+
+    def GetPackHash(self, pack_key: str) -> str:
+        if pack_key in self.pack_hash:
+            return self.pack_hash[pack_key]
+
+        ops = self.GetOpcodes(pack_key)
+        h = hashlib.sha1(str(ops.shape).encode())
+        for op in ops.ravel():
+            # nested packs contribute their content, not their name
+            token = "#" + self.GetPackHash(self.GetPackKey(op)) if IsPackOp(op) else str(op)
+            h.update(token.encode() + b"|")
+        self.pack_hash[pack_key] = h.hexdigest()
+        return self.pack_hash[pack_key]
+
+    def GetCircuitHash(self, pack_key = "") -> str:
+        if self.IsPackedGate(pack_key):
+            return self.GetPackHash(pack_key)
+
+        # the main circuit changes on every edit, so it is hashed fresh each time
+        ops = self.GetOpcodes(pack_key)
+        h = hashlib.sha1(str(ops.shape).encode())
+        h.update(np.ascontiguousarray(ops).tobytes())
+        for op in np.unique(ops):
+            if IsPackOp(op):
+                h.update(f"{op}#{self.GetPackHash(self.GetPackKey(op))}|".encode())
+        return h.hexdigest()
+
+    def GetDependentPacks(self, pack_key: str) -> set[str]:
+        ret = set()
+        stack = [pack_key]
+        while stack:
+            target = self.table.Encode(stack.pop())
+            for key in self.packed_gate:
+                if key not in ret and np.any(self.grids[key].rows == target):
+                    ret.add(key)
+                    stack.append(key)
+        return ret
+
+    def Invalidate(self, pack_key = ""):
         if pack_key == "":
-            new = np.full((self.GetLen(pack_key), 1), "I")
-            self.circuit = np.concatenate((self.circuit, new), axis=1)
-        elif self.IsPackedGate(pack_key):
-            new = np.full((self.GetLen(pack_key), 1), "I")
-            self.packed_gate[pack_key] = np.concatenate((self.packed_gate[pack_key], new), axis=1)
-        else:
-            raise KeyError(pack_key)
+            return
+        for key in {pack_key} | self.GetDependentPacks(pack_key):
+            old_hash = self.pack_hash.pop(key, None)
+            if old_hash is not None and old_hash not in self.pack_hash.values():
+                self.compiled_pack.pop(old_hash, None)
+                self.compiled_sparse_pack.pop(old_hash, None)
 
     def Generate(self, pack_key = ""):
-        ret = 1
-        circuit = self.circuit
-        if self.IsPackedGate(pack_key):
-            circuit = self.packed_gate[pack_key]
-        for line in circuit:
-            base = np.eye(2**len(line), dtype=complex)
-
-            mask = 1
-            gate = 1
-            for key in line:
-                if key == "I":
-                    mask = np.kron(I, mask)
-                    gate = np.kron(I, gate)
-                elif key == "C":
-                    mask = np.kron(ONE, mask)
-                    gate = np.kron(ONE, gate)
-                elif self.IsPackedGate(key):
-                    mask = np.kron(I,mask)
-                    sub_gate = self.Generate(key)
-                    gate = np.kron(sub_gate, gate)
-                elif key.isdigit():
-                    mask = np.kron(I,mask)
+        if not self.IsPackedGate(pack_key):
+            with PROFILER.Timer("cm.Generate"):
+                return self.BuildUnitary(self.GetOpcodes())
+
+        # the cache may be shared with a snapshot on another thread, so keep a local reference
+        pack_hash = self.GetPackHash(pack_key)
+        unitary = self.compiled_pack.get(pack_hash)
+        PROFILER.Count("cache.pack.miss" if unitary is None else "cache.pack.hit")
+        if unitary is None:
+            with PROFILER.Timer("cm.Generate"):
+                unitary = self.BuildUnitary(self.GetOpcodes(pack_key))
+            unitary.flags.writeable = False
+            self.compiled_pack[pack_hash] = unitary
+        return unitary
+
+    def BuildUnitary(self, ops: np.ndarray) -> np.ndarray:
+        qbit_num = ops.shape[1]
+        ret = np.eye(2**qbit_num, dtype=self.dtype)
+        PROFILER.CountAlloc("unitary", ret.nbytes)
+        gates = get_gate_table(self.dtype)
+        identity = I.astype(self.dtype)
+        for line in ops:
+            controls = [int(q_idx) for q_idx in np.flatnonzero(line == OP_C)]
+
+            # gate acts on the non-control qubits only
+            # a typed 1x1 start, kron with a Python int would upcast to complex128
+            gate = np.ones((1, 1), dtype=self.dtype)
+            with PROFILER.Timer("cm.kron"):
+                for op in line:
+                    if op == OP_I:
+                        gate = np.kron(identity, gate)
+                    elif op == OP_C or IsDigitOp(op):
+                        continue
+                    elif IsPackOp(op):
+                        gate = np.kron(self.Generate(self.GetPackKey(op)), gate)
+                    else:
+                        gate = np.kron(gates[op], gate)
+
+            with PROFILER.Timer("cm.dot"):
+                if len(controls) == 0:
+                    ret = np.dot(gate, ret)
+                else:
+                    # only rows whose control bits are all 1 change
+                    idx = get_control_indices(qbit_num, controls)
+                    ret[idx] = np.dot(gate, ret[idx])
+        return ret
+
+    def GenerateSparse(self, pack_key = "") -> SparseUnitary:
+        if not self.IsPackedGate(pack_key):
+            return self.BuildSparseUnitary(self.GetOpcodes())
+
+        pack_hash = self.GetPackHash(pack_key)
+        unitary = self.compiled_sparse_pack.get(pack_hash)
+        if unitary is None:
+            unitary = self.BuildSparseUnitary(self.GetOpcodes(pack_key))
+            self.compiled_sparse_pack[pack_hash] = unitary
+        return unitary
+
+    def BuildSparseUnitary(self, ops: np.ndarray) -> SparseUnitary:
+        # permutation / diagonal lines keep one entry per column (permutation + phase);
+        # other gates expand entries block by block and merge duplicates
+        ret = SparseUnitary.Identity(ops.shape[1])
+        for line in ops:
+            controls = [int(q_idx) for q_idx in np.flatnonzero(line == OP_C)]
+            for q_idx in np.flatnonzero(IsTargetOp(line)):
+                op = line[q_idx]
+                if IsPackOp(op):
+                    pack_key = self.GetPackKey(op)
+                    qbits = list(range(q_idx, q_idx + self.GetQbitNum(pack_key)))
+                    ret = ret.Apply(self.GenerateSparse(pack_key), qbits, controls)
                 else:
-                    mask = np.kron(I, mask)
-                    gate = np.kron(GATES[key], gate)
-            ret = np.dot((base - mask + gate), ret)
+                    ret = ret.Apply(OP_SPARSE_GATES[op], [int(q_idx)], controls)
+                PROFILER.CountAlloc("sparse_unitary", ret.rows.nbytes + ret.cols.nbytes + ret.data.nbytes)
         return ret
 
 if __name__ == "__main__":
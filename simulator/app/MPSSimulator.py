@@ -0,0 +1,210 @@
+from __future__ import annotations
+import threading
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.ShardPlanner import ShardPlanner, SWAP
+from app.ResultBase import SampledResult, MARGINAL_MAX_QBIT
+from app.StateVectorSimulator import DENSE_MAX_QBIT
+from app.Profiler import PROFILER
+
+# bond dimension cap; an MPS holds about qbit_num * 2 * MPS_MAX_BOND^2 amplitudes
+MPS_MAX_BOND = 64
+# singular values this much smaller than the largest are dropped even under the cap
+MPS_CUTOFF = 1e-12
+
+""" matrix product state
+Site q holds qubit q as a (left bond, 2, right bond) tensor and the state is the
+contraction of the chain. A gate on several qubits first moves them onto adjacent
+sites with SWAPs, is applied to the contracted block and split back with SVDs, then
+the SWAPs are undone. Every SVD keeps at most max_bond singular values; the weight
+it drops is added to truncation_error, an estimate of 1 - fidelity.
+
+The chain stays in mixed canonical form: sites left of center are left-orthonormal,
+sites right of it right-orthonormal, so each truncation is optimal for the whole state.
+"""
+
+class MPSSimulator:
+    def __init__(self, cm: CircuitManager, max_bond: int = MPS_MAX_BOND, cutoff: float = MPS_CUTOFF) -> None:
+        self.cm = cm
+        self.planner = ShardPlanner(cm)
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+
+    def GetOps(self, pack_key = "") -> list:
+        # line by line: fused layers would pair up single-qubit gates on distant wires
+        lines = [("line", line) for line in self.planner.compiler.optimizer.GetOpcodes(pack_key)]
+        return list(self.planner.Flatten(lines, list(range(self.cm.GetQbitNum(pack_key))), []))
+
+    def Run(self, pack_key = "", cancel: threading.Event | None = None) -> MPSState | None:
+        """The final state as an MPS; None if cancel was set before it finished."""
+        state = MPSState(self.cm.GetQbitNum(pack_key), self.cm.dtype, self.max_bond, self.cutoff)
+        for matrix, targets, controls in self.GetOps(pack_key):
+            if cancel is not None and cancel.is_set():
+                return None
+            state.ApplyGate(matrix, targets, controls)
+        return state
+
+def expand_gate(matrix: np.ndarray, targets: list[int], controls: list[int], qbits: list[int]) -> np.ndarray:
+    """matrix on targets under controls, as a matrix on qbits where bit j is qbits[j]."""
+    dim = 2**len(qbits)
+    index = np.arange(dim)
+    control_mask = sum(1 << qbits.index(c) for c in controls)
+    target_bits = [qbits.index(t) for t in targets]
+    target_mask = sum(1 << b for b in target_bits)
+    # bit j of a matrix index goes to bit target_bits[j] of the expanded index
+    spread = [sum(((v >> j) & 1) << b for j, b in enumerate(target_bits)) for v in range(len(matrix))]
+    bases = index[(index & control_mask == control_mask) & (index & target_mask == 0)]
+    ret = np.eye(dim, dtype=matrix.dtype)
+    for a in range(len(matrix)):
+        for b in range(len(matrix)):
+            ret[bases | spread[b], bases | spread[a]] = matrix[b, a]
+    return ret
+
+class MPSState(SampledResult):
+    def __init__(self, qbit_num: int, dtype, max_bond: int = MPS_MAX_BOND, cutoff: float = MPS_CUTOFF) -> None:
+        super().__init__(qbit_num)
+        self.dtype = np.dtype(dtype)
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        zero = np.zeros((1, 2, 1), dtype=self.dtype)
+        zero[0, 0, 0] = 1
+        self.tensors = [zero.copy() for _ in range(qbit_num)]
+        self.center = 0
+        self.truncation_error = 0.0
+        self.swap = SWAP.astype(self.dtype)
+        self.marginals: dict[tuple[int, ...], np.ndarray] = {}
+
+    def GetMaxBond(self) -> int:
+        return max([tensor.shape[2] for tensor in self.tensors], default=1)
+
+    def ApplyGate(self, matrix: np.ndarray, targets: list[int], controls: list[int]):
+        qbits = sorted(targets + controls)
+        if len(qbits) == 1:
+            # a unitary on one site keeps the canonical form, no SVD needed
+            self.tensors[qbits[0]] = np.einsum("ab,lbr->lar", matrix, self.tensors[qbits[0]])
+            return
+
+        # blocks are contracted with the lowest site leading, i.e. as the most significant bit
+        gate = expand_gate(matrix.astype(self.dtype), targets, controls, qbits[::-1])
+        start = qbits[0]
+        swaps = []
+        for j, q in enumerate(qbits):
+            for site in range(q - 1, start + j - 1, -1):
+                self.ApplyBlock(self.swap, site, 2)
+                swaps.append(site)
+        self.ApplyBlock(gate, start, len(qbits))
+        for site in reversed(swaps):
+            self.ApplyBlock(self.swap, site, 2)
+
+    def ApplyBlock(self, gate: np.ndarray, site: int, size: int):
+        self.MoveCenter(min(max(self.center, site), site + size - 1))
+        theta = self.tensors[site]
+        for i in range(1, size):
+            theta = np.tensordot(theta, self.tensors[site + i], axes=(-1, 0))
+        left, right = theta.shape[0], theta.shape[-1]
+        theta = np.einsum("ab,lbr->lar", gate, theta.reshape(left, 2**size, right))
+        PROFILER.CountAlloc("mps_block", theta.nbytes)
+
+        # split off one site at a time; the center ends on the last site of the block
+        for i in range(size - 1):
+            u, s, vh = np.linalg.svd(theta.reshape(left * 2, -1), full_matrices=False)
+            keep = self.Truncate(s)
+            self.tensors[site + i] = u[:, :keep].reshape(left, 2, keep)
+            theta = s[:keep, None] * vh[:keep]
+            left = keep
+        self.tensors[site + size - 1] = theta.reshape(left, 2, right)
+        self.center = site + size - 1
+
+    def Truncate(self, s: np.ndarray) -> int:
+        """How many singular values to keep; rescales them in place to keep the norm."""
+        keep = min(len(s), self.max_bond, max(1, int(np.count_nonzero(s > self.cutoff * s[0]))))
+        total = float(np.sum(s.astype(np.float64) ** 2))
+        discarded = float(np.sum(s[keep:].astype(np.float64) ** 2))
+        if discarded > 0 and total > discarded:
+            self.truncation_error += discarded / total
+            s[:keep] *= np.sqrt(total / (total - discarded))
+        return keep
+
+    def MoveCenter(self, site: int):
+        while self.center < site:
+            tensor = self.tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left * 2, right))
+            self.tensors[self.center] = q.reshape(left, 2, -1)
+            self.tensors[self.center + 1] = np.tensordot(r, self.tensors[self.center + 1], axes=(1, 0))
+            self.center += 1
+        while self.center > site:
+            tensor = self.tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left, 2 * right).T)
+            self.tensors[self.center] = q.T.reshape(-1, 2, right)
+            self.tensors[self.center - 1] = np.tensordot(self.tensors[self.center - 1], r.T, axes=(2, 0))
+            self.center -= 1
+
+    def ToStateVector(self) -> np.ndarray:
+        if self.qbit_num > DENSE_MAX_QBIT:
+            raise ValueError(f"{self.qbit_num} qubits is past the dense limit of {DENSE_MAX_QBIT}")
+        psi = np.ones((1, 1), dtype=self.dtype)
+        for tensor in self.tensors:
+            psi = np.tensordot(psi, tensor, axes=(-1, 0))
+        # site 0 leads the contraction, but q[0] is the least significant bit
+        return psi.reshape((2,) * self.qbit_num).transpose().reshape(-1)
+
+    def GetMarginal(self, qbits: list[int] | None = None) -> np.ndarray:
+        """Probabilities of the outcomes of qbits alone; bit j of the index is qbits[j]."""
+        qbits = self.GetQbits(qbits)
+        if len(qbits) > MARGINAL_MAX_QBIT:
+            raise ValueError(f"marginals are limited to {MARGINAL_MAX_QBIT} qubits, got {len(qbits)}")
+        if qbits not in self.marginals:
+            # env[outcomes so far, bond, conjugate bond], kept qubits in site order
+            env = np.ones((1, 1, 1), dtype=self.dtype)
+            for q, tensor in enumerate(self.tensors):
+                if q in qbits:
+                    env = np.einsum("olm,lbr,mbs->obrs", env, tensor, tensor.conj())
+                    env = env.reshape(-1, env.shape[2], env.shape[3])
+                else:
+                    env = np.einsum("olm,lbr,mbs->ors", env, tensor, tensor.conj())
+            probs = env.real.reshape((2,) * len(qbits))
+            # axis i is the i-th kept qubit by site; the index wants qbits[-1] leading
+            kept = sorted(qbits)
+            marginal = np.ascontiguousarray(probs.transpose([kept.index(q) for q in reversed(qbits)])).reshape(-1)
+            marginal = np.maximum(marginal, 0).astype(np.float64)
+            marginal.flags.writeable = False
+            self.marginals[qbits] = marginal
+        return self.marginals[qbits]
+
+    def SampleChunks(self, shots: int, qbits: list[int] | None = None, seed=None):
+        qbits = list(self.GetQbits(qbits))
+        rng = np.random.default_rng(seed)
+        # with every site right of the current one right-orthonormal, the norm of the
+        # partially contracted row is the probability of the outcomes drawn so far
+        self.MoveCenter(0)
+        # per shot: the drawn bits, the row and its two branches at the widest bond
+        chunk = self.GetChunkSize(self.qbit_num + 3 * self.GetMaxBond() * self.dtype.itemsize)
+        for start in range(0, shots, chunk):
+            n = min(chunk, shots - start)
+            bits = np.zeros((n, self.qbit_num), dtype=bool)
+            row = np.ones((n, 1), dtype=self.dtype)
+            for q, tensor in enumerate(self.tensors):
+                branches = np.einsum("sl,lbr->sbr", row, tensor)
+                weights = np.sum(np.abs(branches) ** 2, axis=2)
+                total = weights.sum(axis=1)
+                bits[:, q] = rng.random(n) * total < weights[:, 1]
+                row = branches[np.arange(n), bits[:, q].astype(np.intp)]
+                row /= np.sqrt(weights[np.arange(n), bits[:, q].astype(np.intp)])[:, None]
+            yield bits[:, qbits]
+
+    def GetQbitDensityMatrices(self) -> np.ndarray:
+        """(qbit_num, 2, 2) array; entry q is the reduced density matrix of q[q] alone."""
+        if self.qbit_density is None:
+            rho = np.empty((self.qbit_num, 2, 2), dtype=self.dtype)
+            self.MoveCenter(0)
+            for q in range(self.qbit_num):
+                # at the center the environment on both sides is the identity
+                self.MoveCenter(q)
+                tensor = self.tensors[q]
+                rho[q] = np.einsum("lar,lbr->ab", tensor, tensor.conj())
+            rho.flags.writeable = False
+            self.qbit_density = rho
+        return self.qbit_density
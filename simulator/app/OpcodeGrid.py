@@ -0,0 +1,122 @@
+from __future__ import annotations
+import numpy as np
+
+OPCODE_DTYPE = np.int16
+
+""" opcode layout
+0               "I"
+1               "C"
+GATE_BASE + i   i-th base gate
+DIGIT_BASE + d  pack continuation marker str(d)
+PACK_BASE + i   i-th registered packed gate
+"""
+OP_I = 0
+OP_C = 1
+GATE_BASE = 2
+DIGIT_BASE = 32
+PACK_BASE = 128
+
+# rows reserved up front, so inserting a line shifts the tail instead of reallocating
+INITIAL_CAPACITY = 16
+
+# these work on single opcodes and elementwise on opcode arrays
+def IsGateOp(op):
+    return (op >= GATE_BASE) & (op < DIGIT_BASE)
+
+def IsDigitOp(op):
+    return (op >= DIGIT_BASE) & (op < PACK_BASE)
+
+def IsPackOp(op):
+    return op >= PACK_BASE
+
+def IsTargetOp(op):
+    return IsGateOp(op) | IsPackOp(op)
+
+class OpcodeTable:
+    def __init__(self, gate_keys: list[str]) -> None:
+        self.keys: list[str] = [""] * PACK_BASE
+        self.keys[OP_I] = "I"
+        self.keys[OP_C] = "C"
+        for i, key in enumerate(gate_keys):
+            self.keys[GATE_BASE + i] = key
+        for d in range(PACK_BASE - DIGIT_BASE):
+            self.keys[DIGIT_BASE + d] = str(d)
+        self.ops = {key: op for op, key in enumerate(self.keys) if key != ""}
+        self.key_array = np.array(self.keys)
+
+    def Copy(self) -> OpcodeTable:
+        ret = OpcodeTable([])
+        ret.keys = list(self.keys)
+        ret.ops = dict(self.ops)
+        ret.key_array = self.key_array
+        return ret
+
+    def RegisterPack(self, pack_key: str) -> int:
+        if pack_key not in self.ops:
+            self.ops[pack_key] = len(self.keys)
+            self.keys.append(pack_key)
+            self.key_array = np.array(self.keys)
+        return self.ops[pack_key]
+
+    def Encode(self, key: str) -> int:
+        return self.ops[str(key)]
+
+    def Decode(self, op) -> str:
+        return self.keys[op]
+
+    def EncodeGrid(self, grid) -> np.ndarray:
+        grid = np.asarray(grid)
+        unique, inverse = np.unique(grid, return_inverse=True)
+        ops = np.array([self.Encode(key) for key in unique], dtype=OPCODE_DTYPE)
+        return ops[inverse].reshape(grid.shape)
+
+    def DecodeGrid(self, ops: np.ndarray) -> np.ndarray:
+        # at least "U2", wider when pack keys outgrow it (e.g. "P10")
+        ret = self.key_array[ops].astype(np.result_type("U2", self.key_array.dtype))
+        ret.flags.writeable = False
+        return ret
+
+class OpcodeGrid:
+    def __init__(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows, dtype=OPCODE_DTYPE)
+        self.length = len(rows)
+        self.buffer = np.zeros((max(INITIAL_CAPACITY, 2 * self.length), rows.shape[1]), dtype=OPCODE_DTYPE)
+        self.buffer[:self.length] = rows
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.buffer[:self.length]
+
+    @property
+    def width(self) -> int:
+        return self.buffer.shape[1]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def Copy(self) -> OpcodeGrid:
+        return OpcodeGrid(self.rows)
+
+    def InsertRow(self, line_idx: int, row: np.ndarray | None = None):
+        if not 0 <= line_idx <= self.length:
+            raise IndexError(line_idx)
+        if self.length == len(self.buffer):
+            grown = np.zeros((2 * len(self.buffer), self.width), dtype=OPCODE_DTYPE)
+            grown[:self.length] = self.rows
+            self.buffer = grown
+        self.buffer[line_idx + 1:self.length + 1] = self.buffer[line_idx:self.length]
+        self.buffer[line_idx] = OP_I if row is None else row
+        self.length += 1
+
+    def DeleteRow(self, line_idx: int):
+        if not 0 <= line_idx < self.length:
+            raise IndexError(line_idx)
+        self.buffer[line_idx:self.length - 1] = self.buffer[line_idx + 1:self.length]
+        self.length -= 1
+        self.buffer[self.length] = OP_I
+
+    def AddColumn(self):
+        self.buffer = np.concatenate((self.buffer, np.full((len(self.buffer), 1), OP_I, dtype=OPCODE_DTYPE)), axis=1)
+
+    def SubColumn(self):
+        self.buffer = np.ascontiguousarray(self.buffer[:, :-1])
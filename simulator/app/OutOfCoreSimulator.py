@@ -0,0 +1,136 @@
+from __future__ import annotations
+import json
+import os
+import time
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.ResultFile import CreateResult, OpenState
+from app.ShardPlanner import ShardPlanner, ApplyLocal
+
+# 2^20 complex128 amplitudes = 16 MiB per chunk, a few of them live in RAM at once
+CHUNK_QBIT = 20
+# progress is flushed to disk at most this often
+CHECKPOINT_SECONDS = 30.0
+
+""" out-of-core layout
+<path>           result file (ResultFile.py) holding the state
+<path>.swap      second result file; every pass reads one file and writes the other
+<path>.progress  JSON: circuit hash, dtype, chunk size, pass index, next chunk, which file is current
+
+Chunks are the slices of ShardPlanner. A pass is either a run of local steps, applied to
+one chunk at a time while it sits in RAM, or a single swap of a high bit with a chunk bit.
+Since a pass never writes the file it reads, redoing a chunk after an interruption gives
+the same result, and a run resumes at the first chunk not recorded as done.
+"""
+
+class OutOfCoreSimulator:
+    def __init__(self, cm: CircuitManager, chunk_qbit: int = CHUNK_QBIT,
+                 checkpoint_seconds: float = CHECKPOINT_SECONDS) -> None:
+        self.cm = cm
+        self.planner = ShardPlanner(cm)
+        self.chunk_qbit = chunk_qbit
+        self.checkpoint_seconds = checkpoint_seconds
+
+    def GetPasses(self, ops: list, qbit_num: int, local_num: int) -> list:
+        passes = []
+        for step in self.planner.Plan(ops, qbit_num, local_num):
+            if step[0] == "swap":
+                passes.append(step)
+            elif len(passes) > 0 and passes[-1][0] == "local":
+                passes[-1][1].append(step[1:])
+            else:
+                passes.append(("local", [step[1:]]))
+        return passes
+
+    def Run(self, path: str, resume: bool = True) -> np.memmap:
+        """Simulates the main circuit into the result file at path and returns its state."""
+        qbit_num = self.cm.GetQbitNum()
+        ops = self.planner.GetOps()
+        max_targets = max([len(targets) for _, targets, _ in ops], default=1)
+        local_num = min(qbit_num, max(self.chunk_qbit, max_targets))
+        passes = self.GetPasses(ops, qbit_num, local_num)
+
+        paths = [path, path + ".swap"]
+        progress_path = path + ".progress"
+        progress = {"circuit_hash": self.cm.GetCircuitHash(), "qbit_num": qbit_num, "dtype": self.cm.dtype.str,
+                    "local_num": local_num, "pass": 0, "chunk": 0, "current": 0}
+        saved = self.LoadProgress(progress_path) if resume else None
+        if saved is not None and all(saved.get(key) == progress[key] for key in ("circuit_hash", "qbit_num", "dtype", "local_num")):
+            progress = saved
+            files = [OpenState(p, "r+") for p in paths]
+        else:
+            files = [CreateResult(p, self.cm) for p in paths]
+            # freshly truncated files read as zeros
+            files[0][0] = 1
+            files[0].flush()
+            self.SaveProgress(progress_path, progress)
+
+        chunk_num = 2**(qbit_num - local_num)
+        last_save = time.monotonic()
+        while progress["pass"] < len(passes):
+            step = passes[progress["pass"]]
+            src = files[progress["current"]].reshape(chunk_num, 2**local_num)
+            dst = files[1 - progress["current"]].reshape(chunk_num, 2**local_num)
+            for k in range(progress["chunk"], chunk_num):
+                if step[0] == "local":
+                    chunk = np.array(src[k]).reshape((2,) * local_num)
+                    for local_step in step[1]:
+                        ApplyLocal(chunk, k, local_num, *local_step)
+                    dst[k] = chunk.reshape(-1)
+                else:
+                    dst[k] = self.ExchangeChunk(src, k, local_num, *step[1:])
+
+                if time.monotonic() - last_save >= self.checkpoint_seconds:
+                    files[1 - progress["current"]].flush()
+                    progress["chunk"] = k + 1
+                    self.SaveProgress(progress_path, progress)
+                    last_save = time.monotonic()
+
+            files[1 - progress["current"]].flush()
+            progress.update({"pass": progress["pass"] + 1, "chunk": 0, "current": 1 - progress["current"]})
+            self.SaveProgress(progress_path, progress)
+
+        current = progress["current"]
+        # drop every view of the memmaps before the files are renamed
+        src = dst = None
+        del files
+        if current == 1:
+            os.replace(paths[1], paths[0])
+        elif os.path.exists(paths[1]):
+            os.remove(paths[1])
+        os.remove(progress_path)
+        return OpenState(path)
+
+    def ExchangeChunk(self, src: np.ndarray, k: int, local_num: int, a: int, b: int) -> np.ndarray:
+        """Chunk k of the state with physical bits a (high) and b swapped."""
+        a_bit = 1 << (a - local_num)
+        if b >= local_num:
+            b_bit = 1 << (b - local_num)
+            if bool(k & a_bit) == bool(k & b_bit):
+                return src[k]
+            return src[k ^ a_bit ^ b_bit]
+
+        chunk = np.array(src[k]).reshape((2,) * local_num)
+        partner = np.asarray(src[k ^ a_bit]).reshape((2,) * local_num)
+        # the half whose b bit differs from k's a bit comes from the partner chunk
+        mine = 1 if k & a_bit == 0 else 0
+        index = [slice(None)] * local_num
+        index[local_num - 1 - b] = mine
+        taken = list(index)
+        taken[local_num - 1 - b] = 1 - mine
+        chunk[tuple(index)] = partner[tuple(taken)]
+        return chunk.reshape(-1)
+
+    def LoadProgress(self, path: str) -> dict | None:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def SaveProgress(self, path: str, progress: dict):
+        # write then rename, so an interruption never leaves half a progress file
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(progress, f)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.ShardPlanner import ShardPlanner, ApplyLocal
+from app.Profiler import PROFILER
+
+""" sharding (see ShardPlanner.py for the plan)
+The state lives in one shared buffer with one slice per worker. Every worker applies
+the local steps to its own slice without talking to anyone; swap steps are the only
+points where workers wait for each other.
+"""
+
+class ParallelSimulator:
+    def __init__(self, cm: CircuitManager, workers: int | None = None) -> None:
+        self.cm = cm
+        self.planner = ShardPlanner(cm)
+        self.workers = os.cpu_count() if workers is None else workers
+
+    def GetWorkerNum(self, qbit_num: int, max_targets: int) -> int:
+        # a power of two that still leaves room for the widest gate on local bits
+        workers = 1
+        while workers * 2 <= self.workers and (workers * 2).bit_length() - 1 <= qbit_num - max_targets:
+            workers *= 2
+        return workers
+
+    def Run(self, pack_key = "") -> np.ndarray:
+        qbit_num = self.cm.GetQbitNum(pack_key)
+        ops = self.planner.GetOps(pack_key)
+        max_targets = max([len(targets) for _, targets, _ in ops], default=1)
+        workers = self.GetWorkerNum(qbit_num, max_targets)
+        local_num = qbit_num - (workers.bit_length() - 1)
+        plan = self.planner.Plan(ops, qbit_num, local_num)
+
+        dtype = self.cm.dtype
+        shm = shared_memory.SharedMemory(create=True, size=2**qbit_num * dtype.itemsize)
+        PROFILER.CountAlloc("shared_state", shm.size)
+        try:
+            state = np.ndarray(2**qbit_num, dtype=dtype, buffer=shm.buf)
+            state[:] = 0
+            state[0] = 1
+            if workers == 1:
+                RunShard(shm.name, dtype.str, qbit_num, local_num, 0, plan, None)
+            else:
+                barrier = multiprocessing.Barrier(workers)
+                processes = [multiprocessing.Process(target=RunShard, args=(shm.name, dtype.str, qbit_num, local_num, k, plan, barrier))
+                             for k in range(workers)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                if any(process.exitcode != 0 for process in processes):
+                    raise RuntimeError("a simulation worker failed")
+            ret = state.copy()
+            del state
+        finally:
+            shm.close()
+            shm.unlink()
+        return ret
+
+def RunShard(shm_name: str, dtype: str, qbit_num: int, local_num: int, shard: int, plan: list, barrier):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        slices = np.ndarray((2**(qbit_num - local_num), 2**local_num), dtype=dtype, buffer=shm.buf)
+        for step in plan:
+            if step[0] == "local":
+                ApplyLocal(slices[shard].reshape((2,) * local_num), shard, local_num, *step[1:])
+            else:
+                barrier.wait()
+                ExchangeShard(slices, shard, local_num, *step[1:])
+                barrier.wait()
+        del slices
+    except BaseException:
+        if barrier is not None:
+            barrier.abort()
+        raise
+    finally:
+        shm.close()
+
+def ExchangeShard(slices: np.ndarray, shard: int, local_num: int, a: int, b: int):
+    """Swaps physical bits a (global) and b; each pair of slices is handled by one of its two workers."""
+    a_bit = 1 << (a - local_num)
+    if shard & a_bit:
+        return
+    if b >= local_num:
+        b_bit = 1 << (b - local_num)
+        if shard & b_bit:
+            # bits (a, b) = (0, 1) trade places with (1, 0)
+            partner = shard ^ a_bit ^ b_bit
+            tmp = slices[shard].copy()
+            slices[shard] = slices[partner]
+            slices[partner] = tmp
+        return
+
+    # (high bits, bit b, low bits) keeps the halves as views even when local_num is 1
+    mine_high = slices[shard].reshape(-1, 2, 2**b)[:, 1]
+    other_low = slices[shard ^ a_bit].reshape(-1, 2, 2**b)[:, 0]
+    tmp = mine_high.copy()
+    mine_high[...] = other_low
+    other_low[...] = tmp
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager, GATES
+from app.OpcodeGrid import OP_I, OP_C, GATE_BASE, IsGateOp, IsTargetOp
+from app.Profiler import PROFILER
+
+GATE_OPS = {key: GATE_BASE + i for i, key in enumerate(GATES)}
+# diagonal gates as multiples of the T phase pi/4; products add up mod 8
+PHASE_UNITS = {GATE_OPS["T"]: 1, GATE_OPS["S"]: 2, GATE_OPS["Z"]: 4}
+# fewest gates for each total, e.g. T T -> S, S S -> Z, S S S S -> nothing
+PHASE_GATES = [[op for op in (GATE_OPS["Z"], GATE_OPS["S"], GATE_OPS["T"]) if units & PHASE_UNITS[op]]
+               for units in range(8)]
+
+""" peephole rules, per wire, on uncontrolled single-qubit gates
+X X, Y Y, H H           cancel when nothing else sits between them on the wire
+T, S, Z runs            merged into at most one Z, S and T (Z Z cancels as 8 units)
+"C" and controlled T/S/Z cells are diagonal, so T/S/Z move across them; other gates stop there.
+Controlled X/Y/H targets and packs end a run. Lines left without targets are dropped.
+Every rule is an exact identity, the result has the same unitary including global phase.
+"""
+
+class PeepholeOptimizer:
+    """Shortened copies of opcode grids for the simulators; the editor grid is never changed."""
+
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+        # pack_key -> (circuit hash, optimized grid, gates before, gates after)
+        self.grids: dict[str, tuple[str, np.ndarray, int, int]] = {}
+
+    def GetOpcodes(self, pack_key = "") -> np.ndarray:
+        circuit_hash = self.cm.GetCircuitHash(pack_key)
+        cached = self.grids.get(pack_key)
+        if cached is None or cached[0] != circuit_hash:
+            ops = self.cm.GetOpcodes(pack_key)
+            optimized = self.Optimize(ops)
+            before, after = GetGateCount(ops), GetGateCount(optimized)
+            PROFILER.Count("opt.removed_gates", before - after)
+            cached = self.grids[pack_key] = (circuit_hash, optimized, before, after)
+        return cached[1]
+
+    def GetReduction(self, pack_key = "") -> tuple[int, int]:
+        """Gate count of the grid before and after optimization."""
+        self.GetOpcodes(pack_key)
+        return self.grids[pack_key][2], self.grids[pack_key][3]
+
+    def Optimize(self, ops: np.ndarray) -> np.ndarray:
+        ret = ops.copy()
+        controlled = np.any(ops == OP_C, axis=1)
+        for q_idx in range(ops.shape[1]):
+            # pending gates on this wire: ["gate", op, line], ["phase", units, lines] or ["pass", line]
+            stack = []
+            for line_idx in range(len(ops)):
+                op = ops[line_idx, q_idx]
+                if op == OP_I:
+                    continue
+                if op == OP_C or (controlled[line_idx] and op in PHASE_UNITS):
+                    stack.append(["pass", line_idx])
+                    continue
+                if controlled[line_idx] or not IsGateOp(op):
+                    self.Emit(ret, q_idx, stack)
+                    stack = []
+                    continue
+
+                # re-emitted from the stack once the run ends
+                ret[line_idx, q_idx] = OP_I
+                if op in PHASE_UNITS:
+                    self.PushPhase(stack, PHASE_UNITS[op], line_idx)
+                elif len(stack) > 0 and stack[-1][0] == "gate" and stack[-1][1] == op:
+                    stack.pop()
+                else:
+                    stack.append(["gate", op, line_idx])
+            self.Emit(ret, q_idx, stack)
+        return ret[np.any(IsTargetOp(ret), axis=1)]
+
+    def PushPhase(self, stack: list, units: int, line_idx: int):
+        # diagonal gates commute with each other and with "pass" cells
+        i = len(stack) - 1
+        while i >= 0 and stack[i][0] == "pass":
+            i -= 1
+        if i >= 0 and stack[i][0] == "phase":
+            stack[i][1] = (stack[i][1] + units) % 8
+            stack[i][2].append(line_idx)
+            if stack[i][1] == 0:
+                # e.g. S S S S: gone, so the gates around it may now cancel
+                del stack[i]
+        else:
+            stack.append(["phase", units, [line_idx]])
+
+    def Emit(self, ret: np.ndarray, q_idx: int, stack: list):
+        for item in stack:
+            if item[0] == "gate":
+                ret[item[2], q_idx] = item[1]
+            elif item[0] == "phase":
+                # never more gates than were merged, so their first lines are enough
+                for op, line_idx in zip(PHASE_GATES[item[1]], item[2]):
+                    ret[line_idx, q_idx] = op
+
+def GetGateCount(ops: np.ndarray) -> int:
+    return int(np.count_nonzero(IsTargetOp(ops)))
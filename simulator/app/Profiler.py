@@ -0,0 +1,94 @@
+from __future__ import annotations
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+""" stat names
+sim.*      simulation stages (sim.segment.<i> per checkpoint segment from line i), recorded on the worker thread
+cm.*       unitary construction in CircuitManager (cm.Generate includes nested packs)
+frame.*    main loop: update, draw, idle wait, whole frame
+ui.<Class>.Update / ui.<Class>.Draw   per UI element
+cache.*    hit / miss counters
+alloc.*    state buffers allocated and their bytes
+"""
+
+class TimingStat:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def Add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def ToDict(self) -> dict:
+        return {"count": self.count, "total": self.total, "mean": self.total / max(1, self.count),
+                "max": self.max, "last": self.last}
+
+class Profiler:
+    """Process-wide timings and counters; every hook is a no-op while disabled."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        with self.lock:
+            self.timings: dict[str, TimingStat] = {}
+            self.counters: dict[str, int] = {}
+
+    def Timer(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self.Measure(name)
+
+    @contextmanager
+    def Measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.Add(name, time.perf_counter() - start)
+
+    def Add(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            stat = self.timings.get(name)
+            if stat is None:
+                stat = self.timings[name] = TimingStat()
+            stat.Add(seconds)
+
+    def Count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def CountAlloc(self, name: str, nbytes: int):
+        self.Count(f"alloc.{name}")
+        self.Count(f"alloc.{name}_bytes", nbytes)
+
+    def GetLast(self, name: str) -> float:
+        stat = self.timings.get(name)
+        return 0.0 if stat is None else stat.last
+
+    def ToDict(self) -> dict:
+        with self.lock:
+            return {"timings": {name: stat.ToDict() for name, stat in sorted(self.timings.items())},
+                    "counters": dict(sorted(self.counters.items()))}
+
+    def Export(self, path: str):
+        """JSON with one entry per timing (count, total, mean, max, last seconds) and counter."""
+        data = {"time": time.time(), "argv": sys.argv, **self.ToDict()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+
+PROFILER = Profiler()
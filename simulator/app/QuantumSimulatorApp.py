@@ -2,13 +2,21 @@ from __future__ import annotations
 import pygame
 from pygame import Rect
 import sys
+import time
 
-from static import COLOR, CONFIG
+from static import CONFIG
 
 from app.CircuitManager import * 
+from app.OpcodeGrid import OP_I
+from app.SimulationWorker import SimulationWorker
+from app.SimulationResult import SimulationResult
+from app.MPSSimulator import MPSState
+from app.PeepholeOptimizer import PeepholeOptimizer
+from app.Profiler import PROFILER
 from ui.UIElement import *
 from ui.ButtonUI import *
 from ui.BaseUI import BaseUI
+from ui.Renderer import Renderer
 
 import numpy as np
 
@@ -16,6 +24,14 @@ class QuantumSimulatorApp:
     
     held_module_key = ""
     seleted_pack_key = ""
+    # dump circuit and result to stdout after every Compute
+    verbose = False
+    # timings are exported here on quit when set (main.py --profile)
+    profile_path = ""
+    # 0 shows exact probabilities, otherwise a histogram of this many measurements
+    shots = 0
+    # "probabilities" or "bloch" (reduced state of every qubit)
+    graph_mode = "probabilities"
 
     def __init__(self):
         self.screen = pygame.display.set_mode((CONFIG.SCREEN_WIDTH, CONFIG.SCREEN_HEIGHT))
@@ -27,8 +43,15 @@ class QuantumSimulatorApp:
 
         self.max_module_per_line = 18
         self.result: list[complex] = [0,0]
+        # probabilities and other statistics of self.result, computed on demand
+        self.result_stats = SimulationResult(np.zeros(2, dtype=complex))
+        self.result_version = 0
 
         self.cm = CircuitManager()
+        # only for the verbose gate counts; the worker optimizes its own snapshot
+        self.optimizer = PeepholeOptimizer(self.cm)
+        self.cm.SetPrecision(CONFIG.PRECISION)
+        self.worker = SimulationWorker(self.cm)
         y_circuit = 0
         y_button = CONFIG.CIRCUITSECTIONHEIGHT
         y_util = CONFIG.BUTTONSECTIONHEIGHT + CONFIG.CIRCUITSECTIONHEIGHT
@@ -50,6 +73,16 @@ class QuantumSimulatorApp:
             80, CONFIG.BUTTONSECTIONHEIGHT - 2 * button_margin
             ))
 
+        shots_button = ShotsButtonUI(self, Rect(
+            2 * button_margin + 80, y_button + button_margin,
+            80, CONFIG.BUTTONSECTIONHEIGHT - 2 * button_margin
+            ))
+
+        bloch_button = BlochButtonUI(self, Rect(
+            3 * button_margin + 160, y_button + button_margin,
+            80, CONFIG.BUTTONSECTIONHEIGHT - 2 * button_margin
+            ))
+
         erase_button = EraseButtonUI(self, Rect(
             CONFIG.SCREEN_WIDTH - 100, y_button + button_margin, 
             80, CONFIG.BUTTONSECTIONHEIGHT - 2 * button_margin
@@ -66,18 +99,23 @@ class QuantumSimulatorApp:
                                                  CONFIG.SCREEN_WIDTH * graph_section_percentage, CONFIG.UTILITYSECTIONHRIGHT))
 
         holding_module = HoldingModuleUI(self)
+        profiler_overlay = ProfilerOverlayUI(self)
 
         self.ui_elements: list[BaseUI] = [
             quantum_circuit,
             add_preset_button,
+            shots_button,
+            bloch_button,
             qbit_minus_button,
             qbit_plus_button,
             erase_button,
             self.module_selector,
             prob_graph,
-            holding_module
+            holding_module,
+            profiler_overlay
         ]
-        self.Compute()
+        self.renderer = Renderer(self.screen, self.ui_elements)
+        self.Compute(wait=True)
 
     @property
     def CurrentCircuit(self):
@@ -93,17 +131,43 @@ class QuantumSimulatorApp:
         else:
             self.cm.packed_gate[self.seleted_pack_key] = value
 
+    @property
+    def CurrentOpcodes(self) -> np.ndarray:
+        return self.cm.GetOpcodes(self.seleted_pack_key)
+
     def Clear(self):
         self.CurrentCircuit = np.full((1, self.cm.GetQbitNum(self.seleted_pack_key)), "I", dtype="U2")
 
-    def Compute(self):
-        print(f"=== Circuit {self.seleted_pack_key}===\n{self.CurrentCircuit}")
-
-        q_value = np.zeros((2**self.cm.GetQbitNum(), 1), dtype=complex)
-        q_value[0] = 1
-        gate = self.cm.Generate()
-        self.result = np.dot(gate, q_value)
-        print(f"=== Result === \n{self.result}")
+    def Compute(self, wait = False):
+        if self.verbose:
+            print(f"=== Circuit {self.seleted_pack_key}===\n{self.CurrentCircuit}")
+            before, after = self.optimizer.GetReduction()
+            print(f"gates: {before} -> {after} after peephole optimization")
+
+        # use self.cm.Generate() when the full unitary is needed
+        # the worker resumes from the last stored state before the first edited line
+        self.worker.Submit(self.cm)
+        if wait:
+            self.worker.Wait()
+            self.PollResult()
+
+    def PollResult(self):
+        state = self.worker.Poll()
+        if state is None:
+            return
+        if isinstance(state, MPSState):
+            # past the dense limit only the MPS exists; the graph shows its Bloch vectors
+            self.result = None
+            self.result_stats = state
+        else:
+            self.result = state.reshape(-1, 1)
+            self.result_stats = SimulationResult(state)
+        self.result_version += 1
+        if self.verbose and self.result is None:
+            print(f"=== Result === \nMPS, max bond {state.GetMaxBond()}, truncation error {state.truncation_error:.3e}")
+        elif self.verbose:
+            print(f"=== Result === \n{self.result}")
+            print(f"norm drift: {self.result_stats.GetNormDrift():.3e}")
 
     def AddModule(self, line_idx, q_idx, key):
         if line_idx >= self.cm.GetLen(self.seleted_pack_key):
@@ -123,17 +187,16 @@ class QuantumSimulatorApp:
             NeedNewLine = True
         else:
             for i in range(size):
-                if self.CurrentCircuit[line_idx, q_idx + i] != "I":
+                if self.CurrentOpcodes[line_idx, q_idx + i] != OP_I:
                     NeedNewLine = True
                     break
         if NeedNewLine:
-            new_line = np.full((1, self.cm.GetQbitNum(self.seleted_pack_key)), "I", dtype="U2")
-            self.CurrentCircuit = np.insert(self.CurrentCircuit, line_idx, new_line, axis=0)
+            self.cm.InsertLine(line_idx, self.seleted_pack_key)
 
         # 모듈 삽입
         for i in range(size):
-            self.CurrentCircuit[line_idx, q_idx + i] = str(i)
-        self.CurrentCircuit[line_idx, q_idx] = key
+            self.cm.SetKey(line_idx, q_idx + i, str(i), self.seleted_pack_key)
+        self.cm.SetKey(line_idx, q_idx, key, self.seleted_pack_key)
 
         self.Compute()
 
@@ -144,11 +207,11 @@ class QuantumSimulatorApp:
             raise IndexError(q_idx)
 
         # 모듈 제거
-        key = self.CurrentCircuit[line_idx, q_idx]
+        key = self.cm.GetKey(line_idx, q_idx, self.seleted_pack_key)
         pos_value = 0
         if key.isdigit():
             pos_value = int(key)
-            key = self.CurrentCircuit[line_idx, q_idx - int(key)]
+            key = self.cm.GetKey(line_idx, q_idx - int(key), self.seleted_pack_key)
         
         if key == "I":
             return
@@ -157,34 +220,58 @@ class QuantumSimulatorApp:
             if self.cm.IsPackedGate(key):
                 size = self.cm.GetQbitNum(key)
             for i in range(size):
-                self.CurrentCircuit[line_idx, q_idx - pos_value + i] = "I"
+                self.cm.SetKey(line_idx, q_idx - pos_value + i, "I", self.seleted_pack_key)
         else:
             raise KeyError(key)
         
         # 라인이 빈 경우 라인 제거
-        if np.all(self.CurrentCircuit[line_idx] == "I"):
-            self.CurrentCircuit = np.delete(self.CurrentCircuit, line_idx, axis=0)
+        if np.all(self.CurrentOpcodes[line_idx] == OP_I):
+            self.cm.DeleteLine(line_idx, self.seleted_pack_key)
 
         self.Compute()
 
+    def ExportProfile(self):
+        path = self.profile_path or CONFIG.PROFILE_PATH
+        PROFILER.Export(path)
+        print(f"profile written to {path}")
+
     def run(self):
+        clock = pygame.time.Clock()
         while True:
-            self.update()
-            self.draw()
+            frame_start = time.perf_counter()
+            with PROFILER.Timer("frame.update"):
+                self.update()
+            with PROFILER.Timer("frame.draw"):
+                self.draw()
+            clock.tick(CONFIG.FPS)
+            PROFILER.Add("frame.total", time.perf_counter() - frame_start)
 
     def update(self):
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if len(events) == 0 and not self.worker.IsComputing():
+            # idle: sleep until something happens instead of spinning
+            with PROFILER.Timer("frame.idle"):
+                event = pygame.event.wait(CONFIG.IDLE_WAIT_MS)
+            if event.type != pygame.NOEVENT:
+                events = [event] + pygame.event.get()
+
+        for event in events:
+            if event.type == pygame.WINDOWEXPOSED:
+                self.renderer.Invalidate()
             if event.type == pygame.QUIT:
+                self.worker.Stop()
+                if self.profile_path != "":
+                    self.ExportProfile()
                 pygame.quit()
                 sys.exit()
 
             for ui_element in self.ui_elements:
-                ui_element.Update(event)
+                with PROFILER.Timer(f"ui.{type(ui_element).__name__}.Update"):
+                    ui_element.Update(event)
 
-    def draw(self):        
-        self.screen.fill(COLOR.BACKGROUND)
-        
-        for ui_element in self.ui_elements:
-            ui_element.Draw()
+        # the last completed result stays on screen until a newer one arrives
+        self.PollResult()
 
-        pygame.display.flip()
\ No newline at end of file
+    def draw(self):
+        # repaints and flips only the elements whose render state changed
+        self.renderer.Draw()
\ No newline at end of file
@@ -0,0 +1,76 @@
+from __future__ import annotations
+import numpy as np
+
+# marginals and counts are dense over the 2^k outcomes of the measured qubits
+MARGINAL_MAX_QBIT = 20
+# shots are sampled in chunks whose temporaries stay under this
+SAMPLE_MEMORY_LIMIT = 64 * 2**20  # bytes
+
+class ResultBase:
+    """What every engine's final state offers; subclasses fill in the per-qubit density matrices."""
+
+    def __init__(self, qbit_num: int) -> None:
+        self.qbit_num = qbit_num
+        self.qbit_density: np.ndarray | None = None
+        self.bloch: np.ndarray | None = None
+
+    def GetQbits(self, qbits: list[int] | None) -> tuple[int, ...]:
+        qbits = tuple(range(self.qbit_num)) if qbits is None else tuple(qbits)
+        if len(set(qbits)) != len(qbits) or not all(0 <= q < self.qbit_num for q in qbits):
+            raise IndexError(qbits)
+        return qbits
+
+    def GetQbitDensityMatrices(self) -> np.ndarray:
+        """(qbit_num, 2, 2) array; entry q is the reduced density matrix of q[q] alone."""
+        raise NotImplementedError(f"{type(self).__name__} has no per-qubit density matrices")
+
+    def GetBlochVectors(self) -> np.ndarray:
+        """(qbit_num, 3) array of (x, y, z); length 1 means q[q] is unentangled and pure."""
+        if self.bloch is None:
+            rho = self.GetQbitDensityMatrices()
+            # rho = (I + xX + yY + zZ) / 2
+            self.bloch = np.stack([2 * rho[:, 0, 1].real, -2 * rho[:, 0, 1].imag,
+                                   (rho[:, 0, 0] - rho[:, 1, 1]).real], axis=1).astype(np.float64)
+            self.bloch.flags.writeable = False
+        return self.bloch
+
+class SampledResult(ResultBase):
+    """A state measured shot by shot; subclasses yield the shots in chunks from SampleChunks."""
+
+    def SampleChunks(self, shots: int, qbits: list[int] | None = None, seed=None):
+        """SampleBits rows in chunks, so only one chunk of temporaries is alive at a time."""
+        raise NotImplementedError
+
+    def GetChunkSize(self, shot_bytes: int) -> int:
+        return max(1, SAMPLE_MEMORY_LIMIT // max(1, shot_bytes))
+
+    def SampleBits(self, shots: int, qbits: list[int] | None = None, seed=None) -> np.ndarray:
+        """shots x k bools; column j is the measured value of qbits[j] (all qubits by default)."""
+        qbits = self.GetQbits(qbits)
+        chunks = list(self.SampleChunks(shots, list(qbits), seed))
+        return np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, len(qbits)), dtype=bool)
+
+    def SampleCounts(self, shots: int, qbits: list[int] | None = None, seed=None) -> np.ndarray:
+        """Histogram of shots measurements of qbits; counts[i] is how often outcome i was seen."""
+        qbits = self.GetQbits(qbits)
+        if len(qbits) > MARGINAL_MAX_QBIT:
+            raise ValueError(f"counts are limited to {MARGINAL_MAX_QBIT} qubits, use SampleBitstringCounts")
+        weights = 1 << np.arange(len(qbits), dtype=np.int64)
+        counts = np.zeros(2**len(qbits), dtype=np.int64)
+        for bits in self.SampleChunks(shots, list(qbits), seed):
+            counts += np.bincount(bits.astype(np.int64) @ weights, minlength=len(counts))
+        return counts
+
+    def SampleBitstringCounts(self, shots: int, qbits: list[int] | None = None, seed=None) -> dict[str, int]:
+        """Counts of the observed outcomes of any number of qubits, as bitstrings reading q[k-1]..q[0]."""
+        qbits = self.GetQbits(qbits)
+        counts: dict[bytes, int] = {}
+        for bits in self.SampleChunks(shots, list(qbits), seed):
+            rows, n = np.unique(np.packbits(bits[:, ::-1], axis=1), axis=0, return_counts=True)
+            for row, count in zip(rows, n):
+                counts[row.tobytes()] = counts.get(row.tobytes(), 0) + int(count)
+        ret = {}
+        for row in sorted(counts):
+            bits = np.unpackbits(np.frombuffer(row, dtype=np.uint8))[:len(qbits)]
+            ret["".join("1" if bit else "0" for bit in bits)] = counts[row]
+        return ret
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import json
+import struct
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+
+""" result file layout
+magic    b"QTRS"
+version  uint32 (little endian)
+length   uint64, size of the JSON header that follows
+header   utf-8 JSON: qbit_num, dtype, data_offset, circuit, packed_gate
+padding  up to data_offset (a multiple of DATA_ALIGN)
+state    2**qbit_num raw little-endian complex64/complex128 values, readable with np.memmap
+"""
+
+MAGIC = b"QTRS"
+VERSION = 1
+DATA_ALIGN = 4096
+PREFIX = struct.Struct("<4sIQ")
+
+def WriteHeader(f, cm: CircuitManager, dtype: np.dtype) -> int:
+    header = {
+        "qbit_num": cm.GetQbitNum(),
+        "dtype": dtype.str,
+        "circuit": cm.circuit.tolist(),
+        "packed_gate": {key: grid.tolist() for key, grid in cm.packed_gate.items()},
+    }
+    # data_offset depends on the header size, so reserve room for its digits
+    header["data_offset"] = 0
+    size = PREFIX.size + len(json.dumps(header).encode()) + 20
+    header["data_offset"] = -(-size // DATA_ALIGN) * DATA_ALIGN
+    data = json.dumps(header).encode()
+
+    f.write(PREFIX.pack(MAGIC, VERSION, len(data)))
+    f.write(data)
+    f.write(b"\0" * (header["data_offset"] - PREFIX.size - len(data)))
+    return header["data_offset"]
+
+def ReadHeader(path: str) -> dict:
+    with open(path, "rb") as f:
+        magic, version, length = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a result file")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported version {version}")
+        return json.loads(f.read(length).decode())
+
+def GetStateDtype(cm: CircuitManager) -> np.dtype:
+    # states are stored in the precision they were simulated in
+    return np.dtype(cm.dtype).newbyteorder("<")
+
+def SaveResult(path: str, cm: CircuitManager, state: np.ndarray):
+    state = np.asarray(state).reshape(-1)
+    dtype = GetStateDtype(cm)
+    with open(path, "wb") as f:
+        WriteHeader(f, cm, dtype)
+        state.astype(dtype, copy=False).tofile(f)
+
+def CreateResult(path: str, cm: CircuitManager) -> np.memmap:
+    """Write the header and return a writable memmap for the state."""
+    dtype = GetStateDtype(cm)
+    with open(path, "wb") as f:
+        offset = WriteHeader(f, cm, dtype)
+        f.truncate(offset + dtype.itemsize * 2**cm.GetQbitNum())
+    return np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=(2**cm.GetQbitNum(),))
+
+def OpenState(path: str, mode: str = "r") -> np.memmap:
+    header = ReadHeader(path)
+    return np.memmap(path, dtype=np.dtype(header["dtype"]), mode=mode,
+                     offset=header["data_offset"], shape=(2**header["qbit_num"],))
+
+def LoadResult(path: str, mode: str = "r") -> tuple[CircuitManager, np.memmap]:
+    header = ReadHeader(path)
+    # no fixed width: pack keys such as "P10" are longer than two characters
+    cm = CircuitManager({key: np.array(grid, dtype=str) for key, grid in header["packed_gate"].items()})
+    cm.circuit = np.array(header["circuit"], dtype=str)
+    cm.SetPrecision(np.dtype(header["dtype"]).newbyteorder("="))
+    return cm, OpenState(path, mode)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager, get_gate_table
+from app.OpcodeGrid import OP_C, IsPackOp, IsTargetOp
+from app.CircuitCompiler import CircuitCompiler
+from app.StateVectorSimulator import COMPILED_PACK_MAX_QBIT
+
+SWAP = np.array([[1, 0, 0, 0],
+                 [0, 0, 1, 0],
+                 [0, 1, 0, 0],
+                 [0, 0, 0, 1]], dtype=complex)
+
+""" sharding
+The state is viewed as (slices, 2^local). Physical bit p of an index is local when
+p < local, otherwise it picks the slice. Gates on local bits touch one slice at a time.
+A gate on a global bit first swaps that bit with a free local one: the two slices that
+differ in the global bit exchange the halves that differ in the local bit (pair-exchange),
+and the logical qubit keeps living at its new position until it is swapped again.
+
+plan steps, in physical positions
+("local", matrix, targets, controls)   targets all local, controls anywhere
+("swap", a, b)                         a global, b local or global; moves data between slices
+"""
+
+class ShardPlanner:
+    """Turns a circuit into gate steps on a state split into 2^local-amplitude slices."""
+
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+        self.compiler = CircuitCompiler(cm)
+
+    def GetOps(self, pack_key = "") -> list:
+        qbit_num = self.cm.GetQbitNum(pack_key)
+        return list(self.Flatten(self.compiler.Compile(pack_key), list(range(qbit_num)), []))
+
+    def Flatten(self, program: list, qbits: list[int], controls: list[int]):
+        """Yields (matrix, targets, controls) in absolute qubits, expanding large packs."""
+        for kind, body in program:
+            if kind == "layer":
+                for group, matrix in body:
+                    yield matrix, [qbits[q_idx] for q_idx in group], controls
+                continue
+
+            line_controls = controls + [qbits[i] for i in np.flatnonzero(body == OP_C)]
+            for i in np.flatnonzero(IsTargetOp(body)):
+                op = body[i]
+                if not IsPackOp(op):
+                    yield get_gate_table(self.cm.dtype)[op], [qbits[i]], line_controls
+                    continue
+                key = self.cm.GetPackKey(op)
+                size = self.cm.GetQbitNum(key)
+                if size <= COMPILED_PACK_MAX_QBIT:
+                    yield self.cm.Generate(key), qbits[i:i + size], line_controls
+                else:
+                    yield from self.Flatten(self.compiler.Compile(key), qbits[i:i + size], line_controls)
+
+    def Plan(self, ops: list, qbit_num: int, local_num: int) -> list:
+        # position[q] is the physical bit currently holding logical qubit q
+        position = list(range(qbit_num))
+        plan = []
+
+        def Swap(a: int, b: int):
+            plan.append(("swap", max(a, b), min(a, b)) if max(a, b) >= local_num
+                        else ("local", SWAP.astype(self.cm.dtype), [a, b], []))
+            qa, qb = position.index(a), position.index(b)
+            position[qa], position[qb] = b, a
+
+        for matrix, targets, controls in ops:
+            busy = {position[q] for q in targets}
+            for q in targets:
+                if position[q] < local_num:
+                    continue
+                free = max(p for p in range(local_num) if p not in busy)
+                busy.add(free)
+                Swap(position[q], free)
+            plan.append(("local", matrix, [position[q] for q in targets], [position[q] for q in controls]))
+
+        # back to q[i] = bit i
+        for q in range(qbit_num):
+            if position[q] != q:
+                Swap(position[q], q)
+        return plan
+
+def ApplyLocal(psi: np.ndarray, shard: int, local_num: int, matrix: np.ndarray, targets: list[int], controls: list[int]):
+    # global controls select whole slices
+    for p in controls:
+        if p >= local_num and not (shard >> (p - local_num)) & 1:
+            return
+
+    index = [slice(None)] * psi.ndim
+    for p in controls:
+        if p < local_num:
+            index[psi.ndim - 1 - p] = 1
+    index = tuple(index)
+    view = psi[index]
+    sub_targets = [p - sum(c < p for c in controls if c < local_num) for p in targets]
+
+    # same contraction as StateVectorSimulator.ApplyMatrix
+    size = len(targets)
+    axes = [view.ndim - 1 - p for p in reversed(sub_targets)]
+    tensor = matrix.reshape((2,) * (2 * size))
+    out = np.tensordot(tensor, view, axes=(list(range(size, 2 * size)), axes))
+    psi[index] = np.moveaxis(out, list(range(size)), axes)
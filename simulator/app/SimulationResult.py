@@ -0,0 +1,156 @@
+from __future__ import annotations
+import numpy as np
+
+from app.ResultBase import ResultBase
+
+class SimulationResult(ResultBase):
+    """A finished state vector plus the statistics derived from it, each computed once."""
+
+    def __init__(self, state: np.ndarray) -> None:
+        # contiguous, so GetQbitDensityMatrices can view the amplitudes as (re, im) pairs
+        state = np.ascontiguousarray(np.asarray(state).reshape(-1))
+        super().__init__(max(0, len(state).bit_length() - 1))
+        self.state: np.ndarray | None = state
+        self.probabilities: np.ndarray | None = None
+        self.marginals: dict[tuple[int, ...], np.ndarray] = {}
+        self.sampling: dict[tuple[int, ...], np.ndarray] = {}
+        self.frequencies: dict[int, np.ndarray] = {}
+        self.binned: dict[tuple[int, str, int], np.ndarray] = {}
+        self.top: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = {}
+        self.density: dict[tuple[int, ...], np.ndarray] = {}
+
+    @classmethod
+    def FromProbabilities(cls, probabilities: np.ndarray) -> SimulationResult:
+        """A result known only by its outcome distribution, e.g. averaged noisy trajectories."""
+        ret = cls(np.zeros(len(probabilities), dtype=complex))
+        ret.state = None
+        ret.probabilities = np.array(probabilities, dtype=float)
+        ret.probabilities.flags.writeable = False
+        return ret
+
+    def __len__(self) -> int:
+        return len(self.GetProbabilities())
+
+    def GetState(self) -> np.ndarray:
+        if self.state is None:
+            raise ValueError("this result only has outcome probabilities, not a state vector")
+        return self.state
+
+    def GetProbabilities(self) -> np.ndarray:
+        if self.probabilities is None:
+            self.probabilities = np.abs(self.state) ** 2
+            self.probabilities.flags.writeable = False
+        return self.probabilities
+
+    def GetNormDrift(self) -> float:
+        """How far the total probability has drifted from 1 through rounding."""
+        return abs(float(np.sum(self.GetProbabilities(), dtype=np.float64)) - 1.0)
+
+    def GetMarginal(self, qbits: list[int] | None = None) -> np.ndarray:
+        """Probabilities of the outcomes of qbits alone; bit j of the index is qbits[j]."""
+        qbits = self.GetQbits(qbits)
+        if qbits not in self.marginals:
+            probs = self.GetProbabilities().reshape((2,) * self.qbit_num)
+            # q[i] is tensor axis qbit_num - 1 - i
+            others = tuple(self.qbit_num - 1 - q for q in range(self.qbit_num) if q not in qbits)
+            probs = probs.sum(axis=others)
+            kept = sorted(self.qbit_num - 1 - q for q in qbits)
+            order = [kept.index(self.qbit_num - 1 - q) for q in reversed(qbits)]
+            marginal = np.ascontiguousarray(probs.transpose(order)).reshape(-1)
+            marginal.flags.writeable = False
+            self.marginals[qbits] = marginal
+        return self.marginals[qbits]
+
+    def GetDensityMatrix(self, qbits: list[int]) -> np.ndarray:
+        """Reduced density matrix of qbits with the other qubits traced out; bit j of both indices is qbits[j]."""
+        qbits = self.GetQbits(qbits)
+        if qbits not in self.density:
+            psi = self.GetState().reshape((2,) * self.qbit_num)
+            # kept axes first, most significant (last of qbits) leading, the rest flattened behind
+            kept = [self.qbit_num - 1 - q for q in reversed(qbits)]
+            others = [self.qbit_num - 1 - q for q in range(self.qbit_num) if q not in qbits]
+            m = psi.transpose(kept + others).reshape(2**len(qbits), -1)
+            rho = m @ m.conj().T
+            rho.flags.writeable = False
+            self.density[qbits] = rho
+        return self.density[qbits]
+
+    def GetQbitDensityMatrices(self) -> np.ndarray:
+        """(qbit_num, 2, 2) array; entry q is the reduced density matrix of q[q] alone."""
+        if self.qbit_density is None:
+            psi = self.GetState()
+            probs = self.GetProbabilities()
+            total = np.sum(probs, dtype=np.float64)
+            # (re, im) pairs, so the halves below are strided views and never copied as vdot would
+            parts = psi.view(psi.real.dtype)
+            rho = np.empty((self.qbit_num, 2, 2), dtype=psi.dtype)
+            for q in range(self.qbit_num):
+                # q is the middle axis
+                p1 = np.sum(probs.reshape(-1, 2, 2**q)[:, 1], dtype=np.float64)
+                amps = parts.reshape(-1, 2, 2**q, 2)
+                a0, a1 = amps[:, 0], amps[:, 1]
+                # sum of conj(a1) * a0
+                re = np.einsum("ijk,ijk->", a1, a0)
+                im = np.einsum("ij,ij->", a1[..., 0], a0[..., 1]) - np.einsum("ij,ij->", a1[..., 1], a0[..., 0])
+                coherence = complex(re, im)
+                rho[q] = [[total - p1, coherence], [coherence.conjugate(), p1]]
+            rho.flags.writeable = False
+            self.qbit_density = rho
+        return self.qbit_density
+
+    def GetSamplingTable(self, qbits: list[int] | None = None) -> np.ndarray:
+        # marginal renormalized so rounding in the state norm never trips multinomial
+        qbits = tuple(range(self.qbit_num)) if qbits is None else tuple(qbits)
+        if qbits not in self.sampling:
+            marginal = self.GetMarginal(qbits).astype(np.float64)
+            self.sampling[qbits] = marginal / marginal.sum()
+        return self.sampling[qbits]
+
+    def SampleCounts(self, shots: int, qbits: list[int] | None = None, seed=None) -> np.ndarray:
+        """Histogram of shots measurements of qbits; counts[i] is how often outcome i was seen."""
+        rng = np.random.default_rng(seed)
+        # one multinomial draw costs O(2^n) whatever the number of shots
+        return rng.multinomial(shots, self.GetSamplingTable(qbits))
+
+    def Sample(self, shots: int, qbits: list[int] | None = None, seed=None) -> np.ndarray:
+        """shots measured outcomes of qbits (all qubits by default), as basis indices."""
+        rng = np.random.default_rng(seed)
+        counts = self.SampleCounts(shots, qbits, rng)
+        # shots are independent, so a shuffled histogram is an ordinary shot sequence
+        ret = np.repeat(np.arange(len(counts)), counts)
+        rng.shuffle(ret)
+        return ret
+
+    def GetDistribution(self, shots: int = 0) -> np.ndarray:
+        """Exact probabilities, or the observed frequencies of one fixed run of shots."""
+        if shots <= 0:
+            return self.GetProbabilities()
+        if shots not in self.frequencies:
+            # seeded, so redrawing the same result shows the same histogram
+            self.frequencies[shots] = self.SampleCounts(shots, seed=shots) / shots
+        return self.frequencies[shots]
+
+    def GetBinned(self, bin_num: int, mode: str = "sum", shots: int = 0) -> np.ndarray:
+        """Probabilities reduced to bin_num contiguous index ranges by their max or sum."""
+        key = (bin_num, mode, shots)
+        if key not in self.binned:
+            probs = self.GetDistribution(shots)
+            bin_num = min(bin_num, len(probs))
+            starts = (np.arange(bin_num) * len(probs)) // bin_num
+            if mode == "max":
+                self.binned[key] = np.maximum.reduceat(probs, starts)
+            elif mode == "sum":
+                self.binned[key] = np.add.reduceat(probs, starts)
+            else:
+                raise ValueError(mode)
+        return self.binned[key]
+
+    def GetTop(self, k: int, shots: int = 0) -> tuple[np.ndarray, np.ndarray]:
+        """Indices and probabilities of the k most likely outcomes, most likely first."""
+        k = min(k, len(self))
+        if (k, shots) not in self.top:
+            probs = self.GetDistribution(shots)
+            idx = np.argpartition(probs, len(probs) - k)[len(probs) - k:]
+            idx = idx[np.argsort(probs[idx], kind="stable")[::-1]]
+            self.top[k, shots] = (idx, probs[idx])
+        return self.top[k, shots]
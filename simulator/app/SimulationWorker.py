@@ -0,0 +1,104 @@
+from __future__ import annotations
+import sys
+import threading
+import traceback
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.StateVectorSimulator import StateVectorSimulator, DENSE_MAX_QBIT
+from app.MPSSimulator import MPSSimulator, MPSState
+from app.StateCheckpoint import StateCheckpoint
+from app.Profiler import PROFILER
+
+class SimulationWorker:
+    """Runs Compute on circuit snapshots in a background thread; the newest submission wins."""
+
+    def __init__(self, cm: CircuitManager) -> None:
+        # private manager, restored from each submitted snapshot
+        self.cm = cm.Snapshot()
+        self.simulator = StateVectorSimulator(self.cm)
+        self.checkpoint = StateCheckpoint(self.simulator)
+        self.mps = MPSSimulator(self.cm)
+
+        self.condition = threading.Condition()
+        self.cancel = threading.Event()
+        self.pending: tuple[int, CircuitManager] | None = None
+        self.busy = False
+        self.stopped = False
+        self.job_id = 0
+
+        self.result: np.ndarray | MPSState | None = None
+        self.result_id = 0
+        self.taken_id = 0
+
+        self.thread = threading.Thread(target=self.Loop, name="SimulationWorker", daemon=True)
+        self.thread.start()
+
+    def Submit(self, cm: CircuitManager) -> int:
+        snapshot = cm.Snapshot()
+        with self.condition:
+            self.job_id += 1
+            self.pending = (self.job_id, snapshot)
+            # whatever is running now is already out of date
+            self.cancel.set()
+            self.condition.notify_all()
+            return self.job_id
+
+    def Cancel(self):
+        with self.condition:
+            self.pending = None
+            self.cancel.set()
+            self.condition.notify_all()
+
+    def Stop(self):
+        with self.condition:
+            self.stopped = True
+        self.Cancel()
+        self.thread.join()
+
+    def IsComputing(self) -> bool:
+        with self.condition:
+            return self.busy or self.pending is not None
+
+    def Wait(self, timeout: float | None = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.busy and self.pending is None, timeout)
+
+    def Poll(self) -> np.ndarray | MPSState | None:
+        """The newest completed result, once; None if nothing new has finished."""
+        with self.condition:
+            if self.result_id == self.taken_id:
+                return None
+            self.taken_id = self.result_id
+            return self.result
+
+    def Loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or self.pending is not None)
+                if self.stopped:
+                    return
+                job_id, snapshot = self.pending
+                self.pending = None
+                self.cancel.clear()
+                self.busy = True
+
+            state = None
+            try:
+                self.cm.Restore(snapshot)
+                with PROFILER.Timer("sim.total"):
+                    if self.cm.GetQbitNum() > DENSE_MAX_QBIT:
+                        # no room for a state vector, let alone checkpoints of it
+                        state = self.mps.Run(cancel=self.cancel)
+                    else:
+                        state = self.checkpoint.Run(self.cancel)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                self.checkpoint.Reset()
+
+            with self.condition:
+                self.busy = False
+                if state is not None:
+                    self.result = state
+                    self.result_id = job_id
+                self.condition.notify_all()
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import numpy as np
+
+# entries whose magnitude drops below this after summation are treated as cancelled
+ZERO_TOL = 1e-12
+
+class SparseUnitary:
+    """Coordinate-list operator on qbit_num qubits.
+
+    When every column holds exactly one entry, rows/data are the
+    permutation and phase of a monomial unitary (U|cols[i]> = data[i] |rows[i]>).
+    """
+
+    def __init__(self, qbit_num: int, rows: np.ndarray, cols: np.ndarray, data: np.ndarray) -> None:
+        self.qbit_num = qbit_num
+        self.rows = rows
+        self.cols = cols
+        self.data = data
+
+    @classmethod
+    def Identity(cls, qbit_num: int) -> SparseUnitary:
+        idx = np.arange(2**qbit_num, dtype=np.int64)
+        return cls(qbit_num, idx, idx.copy(), np.ones(len(idx), dtype=complex))
+
+    @classmethod
+    def FromDense(cls, matrix: np.ndarray) -> SparseUnitary:
+        rows, cols = np.nonzero(np.abs(matrix) > ZERO_TOL)
+        qbit_num = len(matrix).bit_length() - 1
+        return cls(qbit_num, rows.astype(np.int64), cols.astype(np.int64),
+                   matrix[rows, cols].astype(complex))
+
+    @property
+    def dim(self) -> int:
+        return 2**self.qbit_num
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def IsPermutation(self) -> bool:
+        if self.nnz != self.dim:
+            return False
+        return bool(np.all(np.bincount(self.cols, minlength=self.dim) == 1)
+                    and np.all(np.bincount(self.rows, minlength=self.dim) == 1))
+
+    def Apply(self, gate: SparseUnitary, qbits: list[int], controls: list[int] = []) -> SparseUnitary:
+        """Left-multiply by gate acting on qbits (gate bit j is qbits[j]) where all controls are 1."""
+        rows, cols, data = self.rows, self.cols, self.data
+        control_bits = sum(1 << q_idx for q_idx in controls)
+        active = (rows & control_bits) == control_bits
+        keep_rows, keep_cols, keep_data = rows[~active], cols[~active], data[~active]
+        rows, cols, data = rows[active], cols[active], data[active]
+
+        local = np.zeros(len(rows), dtype=np.int64)
+        qbit_bits = 0
+        for bit, q_idx in enumerate(qbits):
+            local |= ((rows >> q_idx) & 1) << bit
+            qbit_bits |= 1 << q_idx
+        rest = rows & ~qbit_bits
+
+        # the gate's entries grouped by column, so each row expands into its column's entries
+        order = np.argsort(gate.cols, kind="stable")
+        gate_rows, gate_data = gate.rows[order], gate.data[order]
+        counts = np.bincount(gate.cols, minlength=gate.dim)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        repeat = counts[local]
+        entry = np.repeat(np.arange(len(rows)), repeat)
+        offset = np.arange(len(entry)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+        pos = starts[local[entry]] + offset
+
+        new_local = gate_rows[pos]
+        new_rows = rest[entry].copy()
+        for bit, q_idx in enumerate(qbits):
+            new_rows |= ((new_local >> bit) & 1) << q_idx
+
+        ret = SparseUnitary(self.qbit_num,
+                            np.concatenate((keep_rows, new_rows)),
+                            np.concatenate((keep_cols, cols[entry])),
+                            np.concatenate((keep_data, data[entry] * gate_data[pos])))
+        if not gate.IsPermutation():
+            ret.Coalesce()
+        return ret
+
+    def Coalesce(self):
+        key = self.rows * self.dim + self.cols
+        unique, inverse = np.unique(key, return_inverse=True)
+        data = np.zeros(len(unique), dtype=complex)
+        np.add.at(data, inverse, self.data)
+        nonzero = np.abs(data) > ZERO_TOL
+        self.rows = unique[nonzero] // self.dim
+        self.cols = unique[nonzero] % self.dim
+        self.data = data[nonzero]
+
+    def Dot(self, state: np.ndarray) -> np.ndarray:
+        ret = np.zeros(self.dim, dtype=complex)
+        np.add.at(ret, self.rows, self.data * np.asarray(state).reshape(-1)[self.cols])
+        return ret
+
+    def ToCSR(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        order = np.lexsort((self.cols, self.rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(self.rows, minlength=self.dim))))
+        return indptr, self.cols[order], self.data[order]
+
+    def ToDense(self) -> np.ndarray:
+        ret = np.zeros((self.dim, self.dim), dtype=complex)
+        np.add.at(ret, (self.rows, self.cols), self.data)
+        return ret
+
+    def AllClose(self, other: SparseUnitary, atol: float = 1e-9) -> bool:
+        if self.qbit_num != other.qbit_num:
+            return False
+        diff = SparseUnitary(self.qbit_num,
+                             np.concatenate((self.rows, other.rows)),
+                             np.concatenate((self.cols, other.cols)),
+                             np.concatenate((self.data, -other.data)))
+        diff.Coalesce()
+        return bool(np.all(np.abs(diff.data) <= atol))
@@ -0,0 +1,238 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.OpcodeGrid import OP_C, IsPackOp, IsTargetOp
+from app.ResultBase import SampledResult, MARGINAL_MAX_QBIT
+
+# gates allowed on uncontrolled lines, and under exactly one control
+CLIFFORD_GATES = ("H", "S", "X", "Y", "Z")
+CONTROLLED_CLIFFORD_GATES = ("X", "Y", "Z")
+
+""" stabilizer tableau
+An n-qubit stabilizer state is fixed by n commuting Pauli generators. Row i holds
+generator i as bit-packed x and z parts (64 qubits per uint64 word) and a sign bit:
+(-1)^r * prod_q X_q^x[q] Z_q^z[q], where x = z = 1 is Y. A Clifford gate maps Paulis
+to Paulis, so applying one is a few word operations on one column of every row.
+
+Measured in the computational basis, a stabilizer state is uniform over an affine
+subspace b0 + span(basis). Gaussian elimination of the generators finds it once;
+samples and marginals are then drawn from the subspace, never from the tableau.
+"""
+
+class StabilizerSimulator:
+    """Clifford-only circuits (H, S, X, Y, Z and singly controlled X, Y, Z) in O(n^2) memory."""
+
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+
+    def GetOps(self, pack_key = "") -> list[tuple] | None:
+        """Gates as ("H", q) or ("CX", control, target) in absolute qubits; None if not Clifford."""
+        ops = []
+        qbits = list(range(self.cm.GetQbitNum(pack_key)))
+        return ops if self.Flatten(pack_key, qbits, [], ops) else None
+
+    def Flatten(self, pack_key: str, qbits: list[int], controls: list[int], ops: list) -> bool:
+        for line in self.cm.GetOpcodes(pack_key):
+            # a controlled pack puts its controls on every gate inside
+            line_controls = controls + [qbits[i] for i in np.flatnonzero(line == OP_C)]
+            for i in np.flatnonzero(IsTargetOp(line)):
+                op = line[i]
+                if IsPackOp(op):
+                    key = self.cm.GetPackKey(op)
+                    if not self.Flatten(key, qbits[i:i + self.cm.GetQbitNum(key)], line_controls, ops):
+                        return False
+                    continue
+                key = self.cm.table.Decode(op)
+                if len(line_controls) == 0 and key in CLIFFORD_GATES:
+                    ops.append((key, qbits[i]))
+                elif len(line_controls) == 1 and key in CONTROLLED_CLIFFORD_GATES:
+                    ops.append(("C" + key, line_controls[0], qbits[i]))
+                else:
+                    return False
+        return True
+
+    def IsClifford(self, pack_key = "") -> bool:
+        return self.GetOps(pack_key) is not None
+
+    def Run(self, pack_key = "") -> StabilizerState:
+        ops = self.GetOps(pack_key)
+        if ops is None:
+            raise ValueError("circuit has T gates, a controlled H or S, or more than one control on a gate")
+        tableau = StabilizerTableau(self.cm.GetQbitNum(pack_key))
+        for name, *qbits in ops:
+            getattr(tableau, name)(*qbits)
+        return StabilizerState(tableau)
+
+class StabilizerTableau:
+    def __init__(self, qbit_num: int) -> None:
+        self.qbit_num = qbit_num
+        words = max(1, (qbit_num + 63) // 64)
+        self.x = np.zeros((qbit_num, words), dtype=np.uint64)
+        self.z = np.zeros((qbit_num, words), dtype=np.uint64)
+        self.r = np.zeros(qbit_num, dtype=bool)
+        # |0...0> is stabilized by Z on every qubit
+        for q in range(qbit_num):
+            self.z[q, q >> 6] = np.uint64(1) << np.uint64(q & 63)
+
+    def Copy(self) -> StabilizerTableau:
+        ret = StabilizerTableau(0)
+        ret.qbit_num = self.qbit_num
+        ret.x, ret.z, ret.r = self.x.copy(), self.z.copy(), self.r.copy()
+        return ret
+
+    def GetColumn(self, bits: np.ndarray, q: int) -> np.ndarray:
+        return (bits[:, q >> 6] >> np.uint64(q & 63)) & np.uint64(1) != 0
+
+    def FlipColumn(self, bits: np.ndarray, q: int, mask: np.ndarray):
+        bits[:, q >> 6] ^= mask.astype(np.uint64) << np.uint64(q & 63)
+
+    def H(self, q: int):
+        x, z = self.GetColumn(self.x, q), self.GetColumn(self.z, q)
+        self.r ^= x & z
+        # swapping the x and z bits flips both wherever they differ
+        self.FlipColumn(self.x, q, x ^ z)
+        self.FlipColumn(self.z, q, x ^ z)
+
+    def S(self, q: int):
+        x, z = self.GetColumn(self.x, q), self.GetColumn(self.z, q)
+        self.r ^= x & z
+        self.FlipColumn(self.z, q, x)
+
+    def X(self, q: int):
+        self.r ^= self.GetColumn(self.z, q)
+
+    def Y(self, q: int):
+        self.r ^= self.GetColumn(self.x, q) ^ self.GetColumn(self.z, q)
+
+    def Z(self, q: int):
+        self.r ^= self.GetColumn(self.x, q)
+
+    def CX(self, c: int, t: int):
+        xc, zc = self.GetColumn(self.x, c), self.GetColumn(self.z, c)
+        xt, zt = self.GetColumn(self.x, t), self.GetColumn(self.z, t)
+        self.r ^= xc & zt & ~(xt ^ zc)
+        self.FlipColumn(self.x, t, xc)
+        self.FlipColumn(self.z, c, zt)
+
+    def CZ(self, c: int, t: int):
+        self.H(t)
+        self.CX(c, t)
+        self.H(t)
+
+    def CY(self, c: int, t: int):
+        # CY = S CX S^dagger, and S^dagger = S^3
+        for _ in range(3):
+            self.S(t)
+        self.CX(c, t)
+        self.S(t)
+
+    def MultiplyRows(self, rows: np.ndarray, src: int):
+        """Replaces every row in rows by row src times that row, keeping track of the sign."""
+        x1, z1 = self.x[src], self.z[src]
+        x2, z2 = self.x[rows], self.z[rows]
+        # per qubit, X*Y, Y*Z and Z*X pick up a factor i, the reverse orders -i
+        plus = (x1 & ~z1 & x2 & z2) | (x1 & z1 & ~x2 & z2) | (~x1 & z1 & x2 & ~z2)
+        minus = (x1 & z1 & x2 & ~z2) | (~x1 & z1 & x2 & z2) | (x1 & ~z1 & ~x2 & z2)
+        exponent = (np.bitwise_count(plus).sum(axis=1, dtype=np.int64)
+                    - np.bitwise_count(minus).sum(axis=1, dtype=np.int64)
+                    + 2 * (int(self.r[src]) + self.r[rows].astype(np.int64)))
+        # generators commute, so the product is real: exponent is 0 or 2 mod 4
+        self.r[rows] = exponent % 4 == 2
+        self.x[rows] = x2 ^ x1
+        self.z[rows] = z2 ^ z1
+
+    def SwapRows(self, a: int, b: int):
+        for bits in (self.x, self.z, self.r):
+            bits[[a, b]] = bits[[b, a]]
+
+class StabilizerState(SampledResult):
+    """A finished tableau; measurement outcomes are uniform over b0 + span(basis)."""
+
+    def __init__(self, tableau: StabilizerTableau) -> None:
+        super().__init__(tableau.qbit_num)
+        self.tableau = tableau
+        self.offset: np.ndarray | None = None
+        self.basis: np.ndarray | None = None
+        self.marginals: dict[tuple[int, ...], np.ndarray] = {}
+
+    def GetSupport(self) -> tuple[np.ndarray, np.ndarray]:
+        """b0 as n bools and the basis as k x n bools; every outcome has probability 2^-k."""
+        if self.offset is None:
+            tableau = self.tableau.Copy()
+            n = self.qbit_num
+            # 1. bring the x parts to echelon form; generators left without x are Z-type
+            row = 0
+            for q in range(n):
+                column = tableau.GetColumn(tableau.x, q)
+                candidates = np.flatnonzero(column[row:])
+                if len(candidates) == 0:
+                    continue
+                tableau.SwapRows(row, row + candidates[0])
+                column[[row, row + candidates[0]]] = column[[row + candidates[0], row]]
+                column[row] = False
+                if np.any(column):
+                    tableau.MultiplyRows(np.flatnonzero(column), row)
+                row += 1
+
+            # 2. a Z-type generator (-1)^r Z^z fixes the outcome parity z . b = r
+            words = tableau.z[row:]
+            z = np.unpackbits(words.view(np.uint8), axis=1, bitorder="little")[:, :n].astype(bool)
+            rhs = tableau.r[row:].copy()
+            pivots = []
+            for q in range(n):
+                candidates = np.flatnonzero(z[len(pivots):, q])
+                if len(candidates) == 0:
+                    continue
+                p = len(pivots) + candidates[0]
+                z[[len(pivots), p]] = z[[p, len(pivots)]]
+                rhs[[len(pivots), p]] = rhs[[p, len(pivots)]]
+                others = np.flatnonzero(z[:, q])
+                others = others[others != len(pivots)]
+                z[others] ^= z[len(pivots)]
+                rhs[others] ^= rhs[len(pivots)]
+                pivots.append(q)
+
+            # free qubits are set at random, each pivot qubit follows from its row
+            self.offset = np.zeros(n, dtype=bool)
+            self.offset[pivots] = rhs[:len(pivots)]
+            free = np.setdiff1d(np.arange(n), pivots)
+            self.basis = np.zeros((len(free), n), dtype=bool)
+            self.basis[np.arange(len(free)), free] = True
+            self.basis[:, pivots] = z[:len(pivots)][:, free].T
+        return self.offset, self.basis
+
+    def SampleChunks(self, shots: int, qbits: list[int] | None = None, seed=None):
+        qbits = list(self.GetQbits(qbits))
+        rng = np.random.default_rng(seed)
+        offset, basis = self.GetSupport()
+        projected = basis[:, qbits].astype(np.float32)
+        # per shot: uint8 and float32 coefficients, the float32 product, its int64 parity, the bools
+        chunk = self.GetChunkSize(5 * len(basis) + 13 * len(qbits))
+        for start in range(0, shots, chunk):
+            coefficients = rng.integers(0, 2, (min(chunk, shots - start), len(basis)), dtype=np.uint8).astype(np.float32)
+            # float32 matmul is exact for sums below 2^24 and runs on BLAS, unlike integer matmul
+            parity = (coefficients @ projected).astype(np.int64) & 1
+            yield (parity != 0) ^ offset[qbits]
+
+    def GetMarginal(self, qbits: list[int] | None = None) -> np.ndarray:
+        """Probabilities of the outcomes of qbits alone; bit j of the index is qbits[j]."""
+        qbits = self.GetQbits(qbits)
+        if len(qbits) > MARGINAL_MAX_QBIT:
+            raise ValueError(f"marginals are limited to {MARGINAL_MAX_QBIT} qubits, got {len(qbits)}")
+        if qbits not in self.marginals:
+            offset, basis = self.GetSupport()
+            weights = 1 << np.arange(len(qbits), dtype=np.int64)
+            start = int(offset[list(qbits)] @ weights)
+            # outcomes of qbits are uniform over start ^ span of the projected basis
+            span = np.zeros(1, dtype=np.int64)
+            for vector in basis[:, list(qbits)] @ weights:
+                if len(span) == 2**len(qbits):
+                    break
+                if not np.any(span == vector):
+                    span = np.concatenate([span, span ^ vector])
+            marginal = np.zeros(2**len(qbits))
+            marginal[start ^ span] = 1 / len(span)
+            marginal.flags.writeable = False
+            self.marginals[qbits] = marginal
+        return self.marginals[qbits]
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import math
+import threading
+import numpy as np
+
+from app.OpcodeGrid import OPCODE_DTYPE
+from app.StateVectorSimulator import StateVectorSimulator
+from app.Profiler import PROFILER
+
+CHECKPOINT_MEMORY_LIMIT = 256 * 2**20  # bytes
+# lines between stored states, at least; each stretch between them runs as one fused program
+CHECKPOINT_MIN_INTERVAL = 8
+
+class StateCheckpoint:
+    def __init__(self, simulator: StateVectorSimulator, memory_limit: int = CHECKPOINT_MEMORY_LIMIT) -> None:
+        self.simulator = simulator
+        self.cm = simulator.cm
+        # stored states follow the optimized grid, which the editor never shows
+        self.optimizer = simulator.compiler.optimizer
+        self.memory_limit = memory_limit
+        self.Reset()
+
+    def Reset(self):
+        # grid and pack hashes the stored states were computed from
+        self.ops = np.empty((0, 0), dtype=OPCODE_DTYPE)
+        self.pack_hash: dict[str, str] = {}
+        self.dtype = self.cm.dtype
+        # states[i] is the state after the first i lines of the optimized grid; never line 0,
+        # InitialState rebuilds that one for free
+        self.states: dict[int, np.ndarray] = {}
+        self.interval = CHECKPOINT_MIN_INTERVAL
+        self.max_count = 0
+
+    def GetMaxCount(self, qbit_num: int) -> int:
+        """How many states fit in memory_limit; 0 when even one does not."""
+        state_bytes = self.cm.dtype.itemsize * 2**qbit_num
+        return self.memory_limit // state_bytes
+
+    def GetInterval(self, line_num: int, max_count: int) -> int:
+        if max_count == 0:
+            # nothing is stored, so the whole circuit is one segment
+            return max(CHECKPOINT_MIN_INTERVAL, line_num)
+        # states land on interval, 2 * interval, ... up to line_num
+        return max(CHECKPOINT_MIN_INTERVAL, math.ceil(line_num / max_count))
+
+    def GetFirstChangedLine(self, ops: np.ndarray) -> int:
+        # inserted or deleted rows show up as the first mismatch
+        common = min(len(ops), len(self.ops))
+        same = np.all(ops[:common] == self.ops[:common], axis=1)
+        first = common if np.all(same) else int(np.argmin(same))
+
+        # edited packs invalidate every line that uses them
+        for key in self.cm.packed_gate:
+            if self.pack_hash.get(key) == self.cm.GetPackHash(key):
+                continue
+            rows = np.flatnonzero(np.any(ops == self.cm.table.Encode(key), axis=1))
+            if len(rows) > 0:
+                first = min(first, int(rows[0]))
+        return first
+
+    def Run(self, cancel: threading.Event | None = None) -> np.ndarray | None:
+        ops = self.optimizer.GetOpcodes()
+        qbit_num = self.cm.GetQbitNum()
+        if qbit_num != self.ops.shape[1] or self.dtype != self.cm.dtype:
+            self.Reset()
+            first = 0
+        else:
+            with PROFILER.Timer("sim.diff"):
+                first = self.GetFirstChangedLine(ops)
+        self.max_count = self.GetMaxCount(qbit_num)
+        self.interval = self.GetInterval(len(ops), self.max_count)
+        self.states = {i: state for i, state in self.states.items()
+                       if i <= first and i % self.interval == 0 and self.max_count > 0}
+
+        start = max(self.states, default=0)
+        if start in self.states:
+            state = self.states[start].copy()
+            PROFILER.Count("cache.checkpoint.hit")
+            PROFILER.Count("cache.checkpoint.reused_lines", start)
+        else:
+            state = self.simulator.InitialState(qbit_num)
+            PROFILER.Count("cache.checkpoint.miss")
+
+        # stored states match ops from here on, even if the run is cancelled midway
+        self.ops = ops.copy()
+        self.pack_hash = {key: self.cm.GetPackHash(key) for key in self.cm.packed_gate}
+
+        qbits = list(range(qbit_num))
+        psi = state.reshape((2,) * qbit_num)
+        for segment_start in range(start, len(ops), self.interval):
+            if segment_start > 0 and self.max_count > 0 and segment_start not in self.states:
+                # programs may update psi in place, so stored states are copies
+                self.states[segment_start] = psi.reshape(-1).copy()
+                PROFILER.CountAlloc("checkpoint", psi.nbytes)
+            # fused within the segment only, so every stored state stays a resume point
+            program = self.simulator.compiler.Fuse(ops[segment_start:segment_start + self.interval])
+            with PROFILER.Timer(f"sim.segment.{segment_start}"):
+                for step in program:
+                    if cancel is not None and cancel.is_set():
+                        return None
+                    psi = self.simulator.ApplyProgram(psi, [step], qbits)
+        if len(ops) > 0 and self.max_count > 0 and len(ops) % self.interval == 0:
+            self.states[len(ops)] = psi.reshape(-1)
+        return psi.reshape(-1)
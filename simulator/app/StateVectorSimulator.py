@@ -0,0 +1,104 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager, get_gate_table
+from app.OpcodeGrid import OP_C, IsPackOp, IsTargetOp
+from app.CircuitCompiler import CircuitCompiler
+from app.Profiler import PROFILER
+
+# packs up to this width are applied as one cached unitary instead of line by line
+COMPILED_PACK_MAX_QBIT = 6
+# widest circuit automatic engine choices still give a dense state (1 GiB at complex128)
+DENSE_MAX_QBIT = 26
+
+class StateVectorSimulator:
+    def __init__(self, cm: CircuitManager) -> None:
+        self.cm = cm
+        self.compiler = CircuitCompiler(cm)
+
+    def InitialState(self, qbit_num: int) -> np.ndarray:
+        state = np.zeros(2**qbit_num, dtype=self.cm.dtype)
+        state[0] = 1
+        PROFILER.CountAlloc("state", state.nbytes)
+        return state
+
+    def Run(self, pack_key = "", state: np.ndarray | None = None) -> np.ndarray:
+        qbit_num = self.cm.GetQbitNum(pack_key)
+        if state is None:
+            state = self.InitialState(qbit_num)
+
+        # q[i] is bit i of the state index, i.e. tensor axis n-1-i
+        # controlled lines update the state in place, so never alias the caller's array
+        psi = np.array(state, dtype=self.cm.dtype).reshape((2,) * qbit_num)
+        PROFILER.CountAlloc("state", psi.nbytes)
+        with PROFILER.Timer("sim.run"):
+            psi = self.ApplyProgram(psi, self.compiler.Compile(pack_key), list(range(qbit_num)))
+        return psi.reshape(-1)
+
+    def RunBatch(self, states, pack_key = "") -> np.ndarray:
+        """Final states for many inputs in one pass.
+
+        states is a 2^n x B matrix with one input per column, or a list of B basis indices;
+        the result is the 2^n x B matrix of outputs, i.e. the columns Generate(pack_key) @ states.
+        """
+        qbit_num = self.cm.GetQbitNum(pack_key)
+        states = np.asarray(states)
+        if states.ndim == 1:
+            if not np.issubdtype(states.dtype, np.integer):
+                raise ValueError("a 1-d batch must list basis indices")
+            batch = np.zeros((len(states), 2**qbit_num), dtype=self.cm.dtype)
+            batch[np.arange(len(states)), states] = 1
+        elif states.ndim == 2 and states.shape[0] == 2**qbit_num:
+            batch = np.array(states.T, dtype=self.cm.dtype)
+        else:
+            raise ValueError(f"expected {2**qbit_num} x B states, got {states.shape}")
+
+        # the batch is the leading axis, so q[i] is still axis ndim-1-i
+        psi = batch.reshape((len(batch),) + (2,) * qbit_num)
+        psi = self.ApplyProgram(psi, self.compiler.Compile(pack_key), list(range(qbit_num)))
+        return psi.reshape(len(batch), -1).T
+
+    def ApplyProgram(self, psi: np.ndarray, program: list, qbits: list[int]) -> np.ndarray:
+        for kind, body in program:
+            if kind == "layer":
+                for group, matrix in body:
+                    psi = self.ApplyMatrix(psi, matrix, [qbits[q_idx] for q_idx in group])
+            else:
+                psi = self.ApplyLine(psi, body, qbits)
+        return psi
+
+    def ApplyLine(self, psi: np.ndarray, line: np.ndarray, qbits: list[int]) -> np.ndarray:
+        controls = [qbits[i] for i in np.flatnonzero(line == OP_C)]
+        if len(controls) == 0:
+            return self.ApplyTargets(psi, line, qbits)
+
+        # restrict to the view where every control bit is 1 and update it in place
+        index = [slice(None)] * psi.ndim
+        for q_idx in controls:
+            index[psi.ndim - 1 - q_idx] = 1
+        index = tuple(index)
+        sub_qbits = [q_idx - sum(c < q_idx for c in controls) for q_idx in qbits]
+        psi[index] = self.ApplyTargets(psi[index], line, sub_qbits)
+        return psi
+
+    def ApplyTargets(self, psi: np.ndarray, line: np.ndarray, qbits: list[int]) -> np.ndarray:
+        for i in np.flatnonzero(IsTargetOp(line)):
+            op = line[i]
+            if IsPackOp(op):
+                key = self.cm.GetPackKey(op)
+                size = self.cm.GetQbitNum(key)
+                if size <= COMPILED_PACK_MAX_QBIT:
+                    psi = self.ApplyMatrix(psi, self.cm.Generate(key), qbits[i:i + size])
+                else:
+                    psi = self.ApplyProgram(psi, self.compiler.Compile(key), qbits[i:i + size])
+            else:
+                psi = self.ApplyMatrix(psi, get_gate_table(psi.dtype)[op], [qbits[i]])
+        return psi
+
+    def ApplyMatrix(self, psi: np.ndarray, matrix: np.ndarray, qbits: list[int]) -> np.ndarray:
+        # matrix index bits run from qbits[-1] (most significant) down to qbits[0]
+        size = len(qbits)
+        axes = [psi.ndim - 1 - q_idx for q_idx in reversed(qbits)]
+        tensor = matrix.reshape((2,) * (2 * size))
+        out = np.tensordot(tensor, psi, axes=(list(range(size, 2 * size)), axes))
+        return np.moveaxis(out, list(range(size)), axes)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import numpy as np
+
+from app.CircuitManager import CircuitManager
+from app.OpcodeGrid import OP_I
+from app.StateVectorSimulator import StateVectorSimulator
+
+# trajectory batches are sized so the batch and its gate temporaries stay under this
+TRAJECTORY_MEMORY_LIMIT = 256 * 2**20  # bytes
+# a batched gate holds the input, the tensordot output and the moved copy at once
+TEMPORARY_COPIES = 3
+
+class NoiseModel:
+    """Single-qubit Pauli channels applied to every wire after each circuit line."""
+
+    def __init__(self, depolarizing: float = 0.0, bit_flip: float = 0.0, phase_flip: float = 0.0) -> None:
+        for name, p in (("depolarizing", depolarizing), ("bit_flip", bit_flip), ("phase_flip", phase_flip)):
+            if not 0 <= p <= 1:
+                raise ValueError(f"{name} probability {p} is not in [0, 1]")
+        self.depolarizing = depolarizing
+        self.bit_flip = bit_flip
+        self.phase_flip = phase_flip
+
+    def IsIdeal(self) -> bool:
+        return self.depolarizing == 0 and self.bit_flip == 0 and self.phase_flip == 0
+
+    @classmethod
+    def Parse(cls, text: str) -> NoiseModel:
+        """Reads the "depolarizing=0.01,bit_flip=0.001" form used on the command line."""
+        kwargs = {}
+        for item in text.split(","):
+            if item.strip() == "":
+                continue
+            name, _, value = item.partition("=")
+            name = name.strip()
+            if name not in ("depolarizing", "bit_flip", "phase_flip"):
+                raise ValueError(f"unknown noise channel '{name}'")
+            kwargs[name] = float(value)
+        return cls(**kwargs)
+
+class TrajectorySimulator:
+    """Monte-Carlo noisy simulation; every trajectory is a row of one batched state array."""
+
+    def __init__(self, cm: CircuitManager, memory_limit: int = TRAJECTORY_MEMORY_LIMIT) -> None:
+        self.cm = cm
+        self.simulator = StateVectorSimulator(cm)
+        self.memory_limit = memory_limit
+
+    def GetBatchSize(self, qbit_num: int) -> int:
+        state_bytes = self.cm.dtype.itemsize * 2**qbit_num * TEMPORARY_COPIES
+        return max(1, self.memory_limit // state_bytes)
+
+    def Run(self, noise: NoiseModel, trajectories: int, pack_key = "", seed=None) -> np.ndarray:
+        """Outcome probabilities averaged over the trajectories."""
+        rng = np.random.default_rng(seed)
+        qbit_num = self.cm.GetQbitNum(pack_key)
+        # empty lines are editor padding, not time steps
+        ops = self.cm.GetOpcodes(pack_key)
+        ops = ops[np.any(ops != OP_I, axis=1)]
+
+        probs = np.zeros(2**qbit_num)
+        batch_size = self.GetBatchSize(qbit_num)
+        for start in range(0, trajectories, batch_size):
+            batch = min(batch_size, trajectories - start)
+            psi = self.RunBatch(noise, ops, qbit_num, batch, rng)
+            probs += np.sum(np.abs(psi.reshape(batch, -1)) ** 2, axis=0)
+        return probs / trajectories
+
+    def RunBatch(self, noise: NoiseModel, ops: np.ndarray, qbit_num: int, batch: int, rng) -> np.ndarray:
+        # axis 0 is the trajectory; q[i] stays at axis ndim-1-i as in StateVectorSimulator
+        psi = np.zeros((batch,) + (2,) * qbit_num, dtype=self.cm.dtype)
+        psi[(slice(None),) + (0,) * qbit_num] = 1
+        qbits = list(range(qbit_num))
+        for line in ops:
+            psi = self.simulator.ApplyLine(psi, line, qbits)
+            if not noise.IsIdeal():
+                for q_idx in qbits:
+                    self.ApplyNoise(psi, noise, q_idx, rng)
+        return psi
+
+    def ApplyNoise(self, psi: np.ndarray, noise: NoiseModel, q_idx: int, rng):
+        """Draws one Pauli error per trajectory on q_idx and applies it in place."""
+        batch = len(psi)
+        flip_x = rng.random(batch) < noise.bit_flip
+        flip_z = rng.random(batch) < noise.phase_flip
+        # depolarizing picks X, Y or Z uniformly; Y = iXZ and the global phase is dropped
+        pauli = np.where(rng.random(batch) < noise.depolarizing, rng.integers(1, 4, batch), 0)
+        flip_x ^= (pauli == 1) | (pauli == 2)
+        flip_z ^= (pauli == 2) | (pauli == 3)
+
+        axis = psi.ndim - 1 - q_idx
+        if np.any(flip_x):
+            psi[flip_x] = np.flip(psi[flip_x], axis=axis)
+        if np.any(flip_z):
+            index = [flip_z] + [slice(None)] * (psi.ndim - 1)
+            index[axis] = 1
+            psi[tuple(index)] *= -1
@@ -0,0 +1,216 @@
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.CircuitManager import CircuitManager, GATES
+from app.StateVectorSimulator import StateVectorSimulator
+from app.ParallelSimulator import ParallelSimulator
+from app.MPSSimulator import MPSSimulator
+from app.Profiler import PROFILER
+
+def RunDense(cm: CircuitManager) -> np.ndarray:
+    q_value = np.zeros(2**cm.GetQbitNum(), dtype=cm.dtype)
+    q_value[0] = 1
+    return np.dot(cm.Generate(), q_value)
+
+def RunStateVector(cm: CircuitManager) -> np.ndarray:
+    return StateVectorSimulator(cm).Run()
+
+def RunSparse(cm: CircuitManager) -> np.ndarray:
+    # the sparse engine always works in complex128
+    q_value = np.zeros(2**cm.GetQbitNum(), dtype=complex)
+    q_value[0] = 1
+    return cm.GenerateSparse().Dot(q_value)
+
+def RunParallel(cm: CircuitManager) -> np.ndarray:
+    return ParallelSimulator(cm, PARALLEL_WORKERS).Run()
+
+def RunMPS(cm: CircuitManager) -> np.ndarray:
+    # contracted back to a state vector so it is checked like the others
+    return MPSSimulator(cm).Run().ToStateVector()
+
+# name -> (run function, largest qubit count it is benchmarked at)
+ENGINES = {
+    "dense": (RunDense, 10),
+    "statevector": (RunStateVector, 24),
+    "sparse": (RunSparse, 14),
+    "parallel": (RunParallel, 28),
+    "mps": (RunMPS, 20),
+}
+
+# --workers for the parallel engine; None uses every core
+PARALLEL_WORKERS: int | None = None
+
+# other engines report their speedup over this single-process one when both ran
+SPEEDUP_BASELINE = "statevector"
+
+# results are checked against the dense Generate reference up to this size
+REFERENCE_MAX_QBIT = 8
+# largest accepted error against the complex128 reference, per precision
+PRECISION_TOLERANCE = {"complex64": 1e-4, "complex128": 1e-9}
+
+def BuildCircuit(qbit_num: int, depth: int, control_density: float, nesting: int, seed: int = 0,
+                 precision: str = "complex128") -> CircuitManager:
+    rng = np.random.default_rng(seed)
+    base_keys = list(GATES.keys())
+    cm = CircuitManager({})
+    cm.SetPrecision(precision)
+
+    def RandomLine(width: int, inner_pack: str = "") -> list[str]:
+        line = list(rng.choice(base_keys, size=width))
+        for q_idx in range(width):
+            if rng.random() < control_density:
+                line[q_idx] = "C"
+        if inner_pack != "" and width >= cm.GetQbitNum(inner_pack):
+            line[0] = inner_pack
+            for i in range(1, cm.GetQbitNum(inner_pack)):
+                line[i] = str(i)
+        if all(key == "C" for key in line):
+            line[-1] = base_keys[0]
+        return line
+
+    # each pack wraps the previous one and is one wire wider
+    inner_pack = ""
+    for level in range(nesting):
+        width = 2 + level
+        if width > qbit_num:
+            break
+        cm.AddNewPack()
+        pack_key = f"P{level}"
+        for _ in range(width - 1):
+            cm.AddQbit(pack_key)
+        lines = [RandomLine(width, inner_pack if i == 0 else "") for i in range(3)]
+        cm.packed_gate[pack_key] = np.array(lines, dtype="U2")
+        inner_pack = pack_key
+
+    for _ in range(qbit_num - 1):
+        cm.AddQbit()
+    lines = [RandomLine(qbit_num, inner_pack if i % 4 == 0 else "") for i in range(depth)]
+    cm.circuit = np.array(lines, dtype="U2")
+    return cm
+
+def Measure(engine: str, params: dict, repeat: int, reference: np.ndarray | None) -> dict:
+    run, _ = ENGINES[engine]
+    record = {"engine": engine, **params}
+
+    # timing runs on fresh managers so pack caches start cold
+    times = []
+    for _ in range(repeat):
+        cm = BuildCircuit(**params)
+        start = time.perf_counter()
+        state = run(cm)
+        times.append(time.perf_counter() - start)
+    record["seconds"] = min(times)
+    record["seconds_mean"] = sum(times) / len(times)
+
+    # memory is measured in a separate run since tracing slows everything down
+    cm = BuildCircuit(**params)
+    PROFILER.Reset()
+    PROFILER.enabled = True
+    tracemalloc.start()
+    try:
+        run(cm)
+        record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        PROFILER.enabled = False
+    # buffers the engines report through CountAlloc: alloc.<name> and alloc.<name>_bytes
+    counters = {name[len("alloc."):]: n for name, n in PROFILER.ToDict()["counters"].items()
+                if name.startswith("alloc.")}
+    record["allocations"] = {name: n for name, n in counters.items() if not name.endswith("_bytes")}
+    record["allocated_bytes"] = sum(n for name, n in counters.items() if name.endswith("_bytes"))
+
+    probs = np.abs(np.asarray(state).reshape(-1)) ** 2
+    record["norm_drift"] = abs(float(np.sum(probs, dtype=np.float64)) - 1.0)
+    if reference is not None:
+        record["max_error"] = float(np.max(np.abs(np.asarray(state).reshape(-1) - reference)))
+    return record
+
+def ParseInts(text: str) -> list[int]:
+    ret = []
+    for part in text.split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            ret.extend(range(int(lo), int(hi) + 1))
+        else:
+            ret.append(int(part))
+    return ret
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the simulation engines.")
+    parser.add_argument("--qubits", default="2,4,6,8,10,12,14,16,18,20,22,24", help="e.g. 1-24 or 2,4,8")
+    parser.add_argument("--depth", default="20")
+    parser.add_argument("--control-density", default="0,0.2")
+    parser.add_argument("--nesting", default="0,2")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--precision", default="complex128", help="e.g. complex64,complex128")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parallel engine worker cap (default: every core); more workers than "
+                             "qubits allow checks the narrowest shards")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines output file (default: stdout)")
+    args = parser.parse_args(argv)
+    global PARALLEL_WORKERS
+    PARALLEL_WORKERS = args.workers
+
+    engines = args.engines.split(",")
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine '{engine}'")
+    precisions = args.precision.split(",")
+    for precision in precisions:
+        if precision not in PRECISION_TOLERANCE:
+            parser.error(f"unknown precision '{precision}'")
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    failed = 0
+    try:
+        meta = {"meta": True, "python": platform.python_version(), "numpy": np.__version__,
+                "machine": platform.machine(), "time": time.time()}
+        out.write(json.dumps(meta) + "\n")
+
+        sweep = itertools.product(ParseInts(args.qubits), ParseInts(args.depth),
+                                  [float(x) for x in args.control_density.split(",")],
+                                  ParseInts(args.nesting), precisions)
+        for qbit_num, depth, control_density, nesting, precision in sweep:
+            params = {"qbit_num": qbit_num, "depth": depth, "control_density": control_density,
+                      "nesting": nesting, "seed": args.seed, "precision": precision}
+            reference = None
+            if qbit_num <= REFERENCE_MAX_QBIT:
+                reference = RunDense(BuildCircuit(**{**params, "precision": "complex128"}))
+
+            baseline_seconds = None
+            for engine in engines:
+                if qbit_num > ENGINES[engine][1]:
+                    continue
+                try:
+                    record = Measure(engine, params, args.repeat, reference)
+                except Exception as e:
+                    # one broken engine must not hide the rest of the sweep
+                    failed += 1
+                    out.write(json.dumps({"engine": engine, **params, "error": f"{type(e).__name__}: {e}"}) + "\n")
+                    out.flush()
+                    continue
+                if engine == SPEEDUP_BASELINE:
+                    baseline_seconds = record["seconds"]
+                elif baseline_seconds is not None:
+                    record["speedup"] = baseline_seconds / record["seconds"]
+                if record.get("max_error", 0) > PRECISION_TOLERANCE[precision]:
+                    failed += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# core modules only: workers must never import pygame
+from app.CircuitFile import LoadCircuit
+from app.ResultFile import SaveResult
+from app.SimulationResult import SimulationResult
+from app.StateVectorSimulator import StateVectorSimulator, DENSE_MAX_QBIT
+from app.StabilizerSimulator import StabilizerSimulator, StabilizerState
+from app.MPSSimulator import MPSSimulator, MPS_MAX_BOND
+from app.TrajectorySimulator import NoiseModel, TrajectorySimulator
+from app.OutOfCoreSimulator import OutOfCoreSimulator
+from app.Profiler import PROFILER
+
+def RunFile(path: str, output_dir: str = "", output_format: str = "npy",
+            shots: int = 0, measure: list[int] | None = None, seed: int | None = None,
+            noise: str = "", trajectories: int = 0, out_of_core: bool = False,
+            precision: str = "complex128", profile: bool = False,
+            marginal: list[int] | None = None, bloch: bool = False, engine: str = "auto",
+            max_bond: int = MPS_MAX_BOND) -> dict:
+    record = {"file": path, "precision": precision}
+    try:
+        # per file: pool workers run several files in one process
+        PROFILER.enabled = profile
+        PROFILER.Reset()
+        start = time.perf_counter()
+        cm = LoadCircuit(path)
+        cm.SetPrecision(precision)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if out_of_core:
+            # the state never has to fit in RAM; an interrupted run picks up where it stopped
+            record["qtr"] = os.path.join(output_dir, f"{stem}.qtr")
+            state = OutOfCoreSimulator(cm).Run(record["qtr"])
+            result = SimulationResult(state)
+        elif noise != "":
+            # noisy runs only have averaged probabilities, no state vector
+            probs = TrajectorySimulator(cm).Run(NoiseModel.Parse(noise), trajectories, seed=seed)
+            result = SimulationResult.FromProbabilities(probs)
+        elif engine == "stabilizer" or (engine == "auto" and cm.GetQbitNum() > DENSE_MAX_QBIT
+                                        and StabilizerSimulator(cm).IsClifford()):
+            # Clifford circuits as a tableau: polynomial in the qubit count, but no amplitudes
+            record["engine"] = "stabilizer"
+            result = StabilizerSimulator(cm).Run()
+        elif engine == "mps" or (engine == "auto" and cm.GetQbitNum() > DENSE_MAX_QBIT):
+            # too wide for a state vector: bond-capped matrix product state
+            record["engine"] = "mps"
+            simulator = MPSSimulator(cm, max_bond)
+            result = simulator.Run()
+            record["gates"], record["optimized_gates"] = simulator.planner.compiler.optimizer.GetReduction()
+            record["max_bond"] = result.GetMaxBond()
+            record["truncation_error"] = result.truncation_error
+        else:
+            simulator = StateVectorSimulator(cm)
+            state = simulator.Run()
+            result = SimulationResult(state)
+            # gate counts before and after the peephole pass, the editor grid is unchanged
+            record["gates"], record["optimized_gates"] = simulator.compiler.optimizer.GetReduction()
+        record["seconds"] = time.perf_counter() - start
+        record["qbit_num"] = cm.GetQbitNum()
+        record["line_num"] = cm.GetLen()
+        if isinstance(result, SimulationResult):
+            record["norm_drift"] = result.GetNormDrift()
+        if profile:
+            record["profile"] = PROFILER.ToDict()
+
+        if marginal is not None:
+            # index bit j is marginal[j], like the sampled counts
+            record["marginal"] = result.GetMarginal(marginal).tolist()
+        if bloch:
+            if isinstance(result, StabilizerState):
+                raise ValueError("--bloch needs a state vector")
+            record["bloch"] = result.GetBlochVectors().tolist()
+
+        if shots > 0 and not isinstance(result, SimulationResult):
+            qbits = list(range(cm.GetQbitNum())) if measure is None else measure
+            # too many qubits for an index per outcome: count the sampled bit rows, chunk by chunk
+            record["counts"] = result.SampleBitstringCounts(shots, qbits, seed)
+        elif shots > 0:
+            qbits = list(range(cm.GetQbitNum())) if measure is None else measure
+            counts = result.SampleCounts(shots, qbits, seed)
+            # bitstrings read q[k-1]..q[0] over the measured qubits, zero counts omitted
+            record["counts"] = {format(int(i), f"0{len(qbits)}b"): int(counts[i]) for i in np.flatnonzero(counts)}
+
+        if noise != "":
+            if output_dir != "" and output_format == "npy":
+                record["npy"] = os.path.join(output_dir, f"{stem}.npy")
+                np.save(record["npy"], probs)
+            elif output_dir != "":
+                raise ValueError("--qtr stores a state vector, noisy runs only have probabilities")
+            else:
+                record["probabilities"] = probs.tolist()
+        elif not isinstance(result, SimulationResult):
+            if output_dir != "":
+                raise ValueError(f"{record['engine']} runs have no state vector to write")
+        elif output_dir != "" and output_format == "npy":
+            record["npy"] = os.path.join(output_dir, f"{stem}.npy")
+            np.save(record["npy"], state)
+        elif output_dir != "" and not out_of_core:
+            # header + raw state, open later with ResultFile.OpenState
+            record["qtr"] = os.path.join(output_dir, f"{stem}.qtr")
+            SaveResult(record["qtr"], cm, state)
+        elif not out_of_core:
+            record["amplitudes"] = [[value.real, value.imag] for value in state.tolist()]
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate circuit files without the pygame UI.")
+    parser.add_argument("files", nargs="+", help="circuit text files")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (1 runs in this process)")
+    parser.add_argument("--npy", metavar="DIR", default="",
+                        help="write each final state to DIR/<name>.npy instead of inlining it")
+    parser.add_argument("--qtr", metavar="DIR", default="",
+                        help="write circuit and final state to DIR/<name>.qtr (memory-mappable)")
+    parser.add_argument("--shots", type=int, default=0,
+                        help="also sample this many measurements and report their counts")
+    parser.add_argument("--measure", type=ParseQbits, default=None, metavar="Q,Q,...",
+                        help="qubits measured by --shots (default: all)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for --shots")
+    parser.add_argument("--noise", default="", metavar="CHANNEL=P,...",
+                        help="Monte-Carlo noise after every line, e.g. depolarizing=0.01,bit_flip=0.001,phase_flip=0.001")
+    parser.add_argument("--trajectories", type=int, default=1000,
+                        help="noisy trajectories averaged per circuit (default: 1000)")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="with --qtr, keep the state in the memory-mapped output file and resume interrupted runs")
+    parser.add_argument("--precision", choices=("complex64", "complex128"), default="complex128",
+                        help="dtype of states and gates; complex64 halves memory")
+    parser.add_argument("--engine", choices=("auto", "statevector", "stabilizer", "mps"), default="auto",
+                        help=f"past {DENSE_MAX_QBIT} qubits auto uses the stabilizer tableau for Clifford circuits, else mps")
+    parser.add_argument("--max-bond", type=int, default=MPS_MAX_BOND,
+                        help="bond dimension cap of the mps engine; the record reports the truncation error")
+    parser.add_argument("--marginal", type=ParseQbits, default=None, metavar="Q,Q,...",
+                        help="add the outcome probabilities of these qubits alone")
+    parser.add_argument("--bloch", action="store_true",
+                        help="add the (x, y, z) Bloch vector of every qubit")
+    parser.add_argument("--profile", action="store_true",
+                        help="add per-stage timings, cache and allocation counters to each record")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.npy != "" and args.qtr != "":
+        parser.error("--npy and --qtr are mutually exclusive")
+    output_dir = args.npy or args.qtr
+    output_format = "npy" if args.npy != "" else "qtr"
+    if output_dir != "":
+        os.makedirs(output_dir, exist_ok=True)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    failed = 0
+    output_dirs = [output_dir] * len(args.files)
+    output_formats = [output_format] * len(args.files)
+    if args.out_of_core and (args.qtr == "" or args.noise != ""):
+        parser.error("--out-of-core needs --qtr and no --noise")
+    if args.engine in ("stabilizer", "mps") and (args.noise != "" or args.out_of_core):
+        parser.error(f"--engine {args.engine} cannot be combined with --noise or --out-of-core")
+    if args.bloch and args.noise != "":
+        parser.error("--bloch needs a state vector, --noise only gives probabilities")
+    if args.noise != "":
+        try:
+            NoiseModel.Parse(args.noise)
+        except ValueError as e:
+            parser.error(f"--noise: {e}")
+    sampling = [[value] * len(args.files)
+                for value in (args.shots, args.measure, args.seed, args.noise, args.trajectories, args.out_of_core,
+                              args.precision, args.profile, args.marginal, args.bloch, args.engine,
+                              args.max_bond)]
+    try:
+        if args.workers <= 1:
+            records = map(RunFile, args.files, output_dirs, output_formats, *sampling)
+            failed = WriteRecords(records, out)
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                records = executor.map(RunFile, args.files, output_dirs, output_formats, *sampling)
+                failed = WriteRecords(records, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed > 0 else 0
+
+def ParseQbits(text: str) -> list[int]:
+    return [int(q) for q in text.split(",") if q != ""]
+
+def WriteRecords(records, out) -> int:
+    failed = 0
+    for record in records:
+        if "error" in record:
+            failed += 1
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+    return failed
+
+if __name__ == "__main__":
+    sys.exit(main())
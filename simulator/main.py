@@ -1,8 +1,17 @@
 from __future__ import annotations
+import sys
 import pygame
 from app.QuantumSimulatorApp import QuantumSimulatorApp
+from app.Profiler import PROFILER
+from static import CONFIG
 
 if __name__ == "__main__":
     pygame.init()
+    QuantumSimulatorApp.verbose = "--verbose" in sys.argv
+    if "--profile" in sys.argv:
+        # collect from the first frame and write the stats on quit
+        i = sys.argv.index("--profile")
+        QuantumSimulatorApp.profile_path = sys.argv[i + 1] if i + 1 < len(sys.argv) else CONFIG.PROFILE_PATH
+        PROFILER.enabled = True
     app = QuantumSimulatorApp()
     app.run()
\ No newline at end of file
@@ -3,4 +3,16 @@ CIRCUITSECTIONHEIGHT = 200
 UTILITYSECTIONHRIGHT = 150
 
 SCREEN_WIDTH = 800
-SCREEN_HEIGHT = BUTTONSECTIONHEIGHT + CIRCUITSECTIONHEIGHT + UTILITYSECTIONHRIGHT
\ No newline at end of file
+SCREEN_HEIGHT = BUTTONSECTIONHEIGHT + CIRCUITSECTIONHEIGHT + UTILITYSECTIONHRIGHT
+
+FPS = 60
+IDLE_WAIT_MS = 500
+
+# "complex64" halves memory for one more qubit, "complex128" keeps full precision
+PRECISION = "complex128"
+
+# F4 in the app writes the collected timings here unless --profile names a file
+PROFILE_PATH = "profile.json"
+
+# measurements drawn when the graph shows sampled counts
+SHOTS = 1024
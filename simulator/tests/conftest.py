@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules import each other as app.*, relative to simulator/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,25 @@
+import pytest
+
+from app.CircuitFile import ParseCircuit
+
+PACK_2 = "P0:\nH C\nI X\n\n"
+PACK_1 = "P0:\nH\n\n"
+
+def test_pack_with_its_digits():
+    cm = ParseCircuit(PACK_2 + "main:\nP0 X\n 1 I\n")
+    assert cm.circuit.T.tolist() == [["P0", "X"], ["1", "I"]]
+
+@pytest.mark.parametrize("text", [
+    "main:\nX\n5\n",                    # digit under a plain gate
+    "main:\nI\n1\n",                    # digit under nothing
+    PACK_1 + "main:\nP0\n 1\n",         # digit under a 1-wide pack
+    PACK_2 + "main:\nP0\n 1\n 2\n",     # one digit too many
+    PACK_2 + "main:\nI\n1\n",           # pack exists but is not on this line
+])
+def test_orphan_digits_are_rejected(text):
+    with pytest.raises(ValueError, match="does not continue a pack"):
+        ParseCircuit(text)
+
+def test_missing_digit_is_rejected():
+    with pytest.raises(ValueError, match="needs"):
+        ParseCircuit(PACK_2 + "main:\nP0\n I\n")
@@ -18,6 +18,13 @@ class BaseUI:
     def Draw(self):
         pass
 
+    def GetRenderState(self):
+        """Everything Draw depends on; the renderer repaints the element when it changes."""
+        return None
+
+    def GetDirtyRect(self) -> Rect | None:
+        return self.rect
+
     @property
     def Screen(self) -> Surface:
         return self.App.screen
\ No newline at end of file
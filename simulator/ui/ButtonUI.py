@@ -7,6 +7,7 @@ from pygame.event import Event
 from pygame.font import Font
 
 from ui.BaseUI import BaseUI
+from ui.RenderCache import RenderText
 
 class ButtonUI(BaseUI):
     is_hovering = False
@@ -42,6 +43,9 @@ class ButtonUI(BaseUI):
     def Pressed(self):
         pass
 
+    def GetRenderState(self):
+        return (self.text, self.enabled, self.button_pressed, self.is_hovering)
+
     def Draw(self):
         color = self.color
         if not self.enabled:
@@ -52,7 +56,7 @@ class ButtonUI(BaseUI):
             color = self.hovering_color
         pygame.draw.rect(self.Screen, color, self.rect)
         
-        text = self.font.render(self.text, True, COLOR.BLACK)  # Text rendering
+        text = RenderText(self.font, self.text, COLOR.BLACK)
         text_rect = text.get_rect(center=self.rect.center)
         self.Screen.blit(text, text_rect)
 
@@ -71,6 +75,22 @@ class AddPresetButtonUI(ButtonUI):
     def Pressed(self):
         self.CM.AddNewPack()
 
+class ShotsButtonUI(ButtonUI):
+    def __init__(self, app, rect):
+        super().__init__(app, rect, "Shots", app.baseFont, COLOR.SHADYSKY, COLOR.WHITE, COLOR.GRAY)
+
+    def Pressed(self):
+        # toggles the graph between exact probabilities and a sampled histogram
+        self.App.shots = 0 if self.App.shots > 0 else CONFIG.SHOTS
+
+class BlochButtonUI(ButtonUI):
+    def __init__(self, app, rect):
+        super().__init__(app, rect, "Bloch", app.baseFont, COLOR.SHADYSKY, COLOR.WHITE, COLOR.GRAY)
+
+    def Pressed(self):
+        # toggles the graph between outcome probabilities and per-qubit Bloch vectors
+        self.App.graph_mode = "probabilities" if self.App.graph_mode == "bloch" else "bloch"
+
 class QbitMinusButton(ButtonUI):
     def __init__(self, app, rect, text):
         super().__init__(app, rect, text, app.baseFont, COLOR.WHITE, COLOR.LIGHTGRAY, COLOR.GRAY)
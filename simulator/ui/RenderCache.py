@@ -0,0 +1,38 @@
+from __future__ import annotations
+from pygame import Surface
+from pygame.font import Font
+
+from static import COLOR
+from app.Profiler import PROFILER
+
+# glyph and module surfaces are pure functions of their key, so they are rendered once
+MAX_CACHE_SIZE = 4096
+
+text_cache: dict[tuple, Surface] = {}
+module_cache: dict[tuple, Surface] = {}
+
+def RenderText(font: Font, text: str, color) -> Surface:
+    key = (font, text, color)
+    surface = text_cache.get(key)
+    PROFILER.Count("cache.text.miss" if surface is None else "cache.text.hit")
+    if surface is None:
+        if len(text_cache) >= MAX_CACHE_SIZE:
+            text_cache.clear()
+        surface = font.render(text, True, color)  # Text rendering
+        text_cache[key] = surface
+    return surface
+
+def GetModuleSurface(key: str, size: tuple[int, int], color, font: Font) -> Surface:
+    cache_key = (key, size, color, font)
+    surface = module_cache.get(cache_key)
+    PROFILER.Count("cache.module.miss" if surface is None else "cache.module.hit")
+    if surface is None:
+        if len(module_cache) >= MAX_CACHE_SIZE:
+            module_cache.clear()
+        surface = Surface(size)
+        surface.fill(color)
+        if key != "":
+            text = RenderText(font, key, COLOR.BLACK)
+            surface.blit(text, text.get_rect(center=(size[0] / 2, size[1] / 2)))
+        module_cache[cache_key] = surface
+    return surface
@@ -0,0 +1,59 @@
+from __future__ import annotations
+import pygame
+from pygame import Rect
+
+from static import COLOR
+from ui.BaseUI import BaseUI
+from app.Profiler import PROFILER
+
+class Renderer:
+    """Redraws only the elements whose render state changed and flips just those regions."""
+
+    def __init__(self, screen: pygame.Surface, ui_elements: list[BaseUI]) -> None:
+        self.screen = screen
+        self.ui_elements = ui_elements
+        self.states: dict[BaseUI, object] = {}
+        self.rects: dict[BaseUI, Rect | None] = {}
+        self.full_redraw = True
+
+    def Invalidate(self):
+        self.full_redraw = True
+
+    def DrawElement(self, ui_element: BaseUI):
+        with PROFILER.Timer(f"ui.{type(ui_element).__name__}.Draw"):
+            ui_element.Draw()
+
+    def Draw(self) -> bool:
+        dirty: list[Rect] = []
+        for ui_element in self.ui_elements:
+            state = ui_element.GetRenderState()
+            rect = ui_element.GetDirtyRect()
+            if ui_element not in self.states or state != self.states[ui_element]:
+                # both where it was and where it is now
+                dirty += [r for r in (self.rects.get(ui_element), rect) if r is not None]
+            self.states[ui_element] = state
+            self.rects[ui_element] = rect
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.screen.fill(COLOR.BACKGROUND)
+            for ui_element in self.ui_elements:
+                self.DrawElement(ui_element)
+            pygame.display.flip()
+            return True
+
+        if len(dirty) == 0:
+            return False
+
+        dirty = [Rect(rect).clip(self.screen.get_rect()) for rect in dirty]
+        for rect in dirty:
+            # overlapping elements (e.g. the held module) are repainted inside the clip too
+            self.screen.set_clip(rect)
+            self.screen.fill(COLOR.BACKGROUND, rect)
+            for ui_element in self.ui_elements:
+                element_rect = self.rects[ui_element]
+                if element_rect is not None and Rect(element_rect).colliderect(rect):
+                    self.DrawElement(ui_element)
+            self.screen.set_clip(None)
+        pygame.display.update(dirty)
+        return True
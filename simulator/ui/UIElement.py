@@ -9,6 +9,10 @@ from static import COLOR, CONFIG
 import app.QuantumSimulatorApp as qs
 import static.EventHandler as EH 
 from app.CircuitManager import GATES
+from app.OpcodeGrid import OP_C, IsPackOp, IsTargetOp
+from ui.RenderCache import RenderText, GetModuleSurface
+from app.Profiler import PROFILER
+from app.MPSSimulator import MPSState
 
 import numpy as np
 
@@ -36,12 +40,7 @@ def DrawModule(surface: Surface, key: str, topCenter, font: Font, moduleSize: in
         color = COLOR.MODULE_COLOR[key]
     
     rect = GetModuleRect(topCenter, moduleSize)
-    pygame.draw.rect(surface, color, rect)
-
-    if key != "":
-        text = font.render(key, True, COLOR.BLACK)  # Text rendering
-        text_rect = text.get_rect(center=rect.center)
-        surface.blit(text, text_rect)
+    surface.blit(GetModuleSurface(key, rect.size, color, font), rect)
 
 # Quantum Circuit UI Class
 class QuantumCircuitUI(BaseUI):
@@ -57,6 +56,16 @@ class QuantumCircuitUI(BaseUI):
             if target_coord != None:
                 self.App.RemoveModule(target_coord[0], target_coord[1])
 
+    def GetRenderState(self):
+        ops = self.App.CurrentOpcodes
+        pack_widths = tuple(self.CM.GetQbitNum(key) for key in self.CM.packed_gate)
+        return (self.App.seleted_pack_key, ops.shape, ops.tobytes(), pack_widths)
+
+    def GetDirtyRect(self) -> Rect:
+        # wires below the section still belong to this element
+        height = LINEMARGINTOP + (self.CM.GetQbitNum(self.App.seleted_pack_key) + 1) * LINESPACE
+        return self.rect.union(Rect(self.rect.left, self.rect.top, self.rect.width, height))
+
     def GetLineHeight(self, yi):
         return self.rect.top + LINEMARGINTOP + (yi + 0.5) * LINESPACE
 
@@ -72,22 +81,20 @@ class QuantumCircuitUI(BaseUI):
         return Rect(topleft, size)
 
     def GetHoverTargetCoord(self):
+        # cells are a regular grid, so the hit cell follows from the layout constants
         mx, my = pygame.mouse.get_pos()
-        target_rect = Rect(mx,my,1,1)
-        for xi, line in enumerate(self.App.CurrentCircuit):
-            for yi, key in enumerate(line):
-                rect = self.GetCollisionRect(xi, yi)
-                if rect.contains(target_rect):
-                    return (xi, yi)
-        else:
-            qbit_num = self.CM.GetQbitNum(self.App.seleted_pack_key)
-            line_num = self.CM.GetLen(self.App.seleted_pack_key)
-            for yi in range(qbit_num):
-                y = self.GetLineHeight(yi)
-                y_min = y - LINESPACE / 2
-                y_max = y + LINESPACE / 2
-                if y_min < my < y_max:
-                    return (line_num - 1, yi)
+        qbit_num = self.CM.GetQbitNum(self.App.seleted_pack_key)
+        line_num = self.CM.GetLen(self.App.seleted_pack_key)
+        dx = mx - (self.rect.left + LINEMARGINLEFT)
+        dy = my - (self.rect.top + LINEMARGINTOP)
+        xi = int(dx // (MODULE_SIZE + MODULEMARGIN))
+        yi = int(dy // LINESPACE)
+        if 0 <= xi < line_num and 0 <= yi < qbit_num:
+            return (xi, yi)
+
+        # anywhere else on a wire appends to the last line
+        if 0 <= yi < qbit_num and dy % LINESPACE != 0:
+            return (line_num - 1, yi)
         return None
 
     def Draw(self):
@@ -98,7 +105,7 @@ class QuantumCircuitUI(BaseUI):
         # draw base lines
         for yi in range(self.CM.GetQbitNum(self.App.seleted_pack_key)):
             y = self.GetLineHeight(yi)
-            text = self.App.baseFont.render(f"q[{yi}]", True, COLOR.BASETEXT)  # Text rendering
+            text = RenderText(self.App.baseFont, f"q[{yi}]", COLOR.BASETEXT)
             text_rect = text.get_rect(center=(25, y))
             self.Screen.blit(text, text_rect)
             pygame.draw.line(self.Screen, COLOR.BASELINE, (LINEMARGINLEFT, y), (CONFIG.SCREEN_WIDTH - LINEMARGINRIGHT, y), width=LINEWIDTH)
@@ -108,30 +115,31 @@ class QuantumCircuitUI(BaseUI):
         pygame.draw.line(self.Screen, COLOR.BASELINE, (LINEMARGINLEFT, y - 2), (CONFIG.SCREEN_WIDTH - LINEMARGINRIGHT, y - 2), width=LINEWIDTH // 2)
         pygame.draw.line(self.Screen, COLOR.BASELINE, (LINEMARGINLEFT, y + 2), (CONFIG.SCREEN_WIDTH - LINEMARGINRIGHT, y + 2), width=LINEWIDTH // 2)
 
+        ops = self.App.CurrentOpcodes
+
         # control line
-        for xi, line in enumerate(self.App.CurrentCircuit):
-            for yi, key in enumerate(line):
-                if key == 'C':
-                    cx, cy = self.GetCoordCenter(xi, yi)
-                    y_min = self.GetLineHeight(0)
-                    y_max = self.GetLineHeight(len(line) - 1)
-                    pygame.draw.line(self.Screen, COLOR.GRAY, (cx, y_min), (cx, y_max), 2)
-                    break
+        for xi, line in enumerate(ops):
+            if np.any(line == OP_C):
+                cx, cy = self.GetCoordCenter(xi, 0)
+                y_min = self.GetLineHeight(0)
+                y_max = self.GetLineHeight(len(line) - 1)
+                pygame.draw.line(self.Screen, COLOR.GRAY, (cx, y_min), (cx, y_max), 2)
 
         # draw line modules
-        for xi, line in enumerate(self.App.CurrentCircuit):
-            for yi, key in enumerate(line):
-                if key == "I" or key.isdigit():
-                    continue
+        for xi, line in enumerate(ops):
+            is_controlled = np.any(line == OP_C)
+            for yi in np.flatnonzero(IsTargetOp(line) | (line == OP_C)):
+                op = line[yi]
+                key = self.CM.table.Decode(op)
                 center = self.GetCoordCenter(xi, yi)
 
                 module_size = 1
-                if self.CM.IsPackedGate(key):
+                if IsPackOp(op):
                     module_size = self.CM.GetQbitNum(key)
 
                 DrawModule(self.Screen, key, center, self.App.moduleFont, module_size)
 
-                if "C" in line:
+                if is_controlled:
                     rect = GetModuleRect(center, module_size)
                     pygame.draw.rect(self.Screen, COLOR.GRAY, rect, 3)
 
@@ -153,6 +161,9 @@ class ModuleSelectorUI(BaseUI):
     def __init__(self, app: qs.QuantumSimulatorApp, rect: Rect):
         super().__init__(app, rect)
         self.modules_per_line = self.rect.width // (MODULE_SIZE + 10)
+        self.layout_pack_keys: tuple[str, ...] | None = None
+        self.layout_keys: list[str] = []
+        self.layout_rects: list[Rect] = []
     
     def GetRectCenter(self, i:int):
         xi = i % self.modules_per_line
@@ -164,25 +175,38 @@ class ModuleSelectorUI(BaseUI):
     def GetSeletableKeys(self):
         return list(GATES.keys()) + ['C'] + list(self.CM.packed_gate.keys())
 
+    def GetLayout(self) -> tuple[list[str], list[Rect]]:
+        # only packs change the selectable keys
+        pack_keys = tuple(self.CM.packed_gate.keys())
+        if self.layout_pack_keys != pack_keys:
+            self.layout_pack_keys = pack_keys
+            self.layout_keys = self.GetSeletableKeys()
+            self.layout_rects = [GetModuleRect(self.GetRectCenter(i)) for i in range(len(self.layout_keys))]
+        return self.layout_keys, self.layout_rects
+
     def GetKeyRectDict(self) -> dict[str, Rect]:
-        ret = {}
-        for i, key in enumerate(self.GetSeletableKeys()):
-            center = self.GetRectCenter(i)
-            ret[key] = GetModuleRect(center)
-        return ret
+        keys, rects = self.GetLayout()
+        return dict(zip(keys, rects))
 
     def Draw(self):
-        for i, key in enumerate(self.GetSeletableKeys()):
-            center = self.GetRectCenter(i)
-            DrawModule(self.Screen, key, center, self.App.moduleFont, 1)
+        for i, (key, rect) in enumerate(zip(*self.GetLayout())):
+            DrawModule(self.Screen, key, self.GetRectCenter(i), self.App.moduleFont, 1)
             if self.App.seleted_pack_key == key:
-                rect = GetModuleRect(center)
                 pygame.draw.rect(self.Screen, COLOR.BLACK, rect, width=3)
 
+    def GetRenderState(self):
+        return (tuple(self.GetLayout()[0]), self.App.seleted_pack_key)
+
     def GetMouseHoveringModuleKey(self, mx, my) -> str:
-        for key, rect in self.GetKeyRectDict().items():
-            if rect.contains(Rect(mx, my, 1, 1)):
-                return key
+        cell = self.margin + MODULE_SIZE
+        xi = int((mx - self.rect.left) // cell)
+        yi = int((my - self.rect.top) // cell)
+        if not 0 <= xi < self.modules_per_line or yi < 0:
+            return ""
+        keys, rects = self.GetLayout()
+        i = yi * self.modules_per_line + xi
+        if i < len(keys) and rects[i].contains(Rect(mx, my, 1, 1)):
+            return keys[i]
         return ""
 
     def Update(self, event: Event):
@@ -207,6 +231,21 @@ class HoldingModuleUI(BaseUI):
     def Update(self, event: Event):
         if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
             self.App.held_module_key = ""
+
+    def GetHeldRect(self) -> Rect | None:
+        if self.App.held_module_key == "":
+            return None
+        size = 1
+        if self.CM.IsPackedGate(self.App.held_module_key):
+            size = self.CM.GetQbitNum(self.App.held_module_key)
+        return GetModuleRect(pygame.mouse.get_pos(), size)
+
+    def GetRenderState(self):
+        rect = self.GetHeldRect()
+        return (self.App.held_module_key, None if rect is None else tuple(rect))
+
+    def GetDirtyRect(self) -> Rect | None:
+        return self.GetHeldRect()
     
     def Draw(self):
         if self.App.held_module_key != "":
@@ -219,31 +258,188 @@ class HoldingModuleUI(BaseUI):
 class ProbGraphUI(BaseUI):
     baseline_margin = 30
     graph_width = 10
+    # narrower slots switch to one aggregated bar per pixel column
+    min_slot_width = 1
+    # "sum" keeps the total probability of a column, "max" its highest outcome
+    bin_mode = "sum"
+    top_k = 5
+    # bar colors of the x, y and z Bloch components
+    bloch_colors = (COLOR.BLUSHRED, COLOR.YELLOW, COLOR.GRAPHBLUE)
+    # strip above the Bloch bars for the legend
+    bloch_header = 20
 
     def __init__(self, app, rect):
         super().__init__(app, rect)
 
+    def DrawBars(self, stats, baseline_x_min, baseline_width, graph_max_height):
+        probs = stats.GetDistribution(self.App.shots)
+        slot_width = baseline_width / len(probs)
+        width = min(self.graph_width, max(1, slot_width - 1))
+        qbit_num = stats.qbit_num
+        # labels only while they do not run into each other
+        show_labels = self.App.baseFont.size(f"|{'0' * qbit_num}⟩")[0] <= slot_width
+        for q_idx, prob in enumerate(probs):
+            x = baseline_x_min + (q_idx + 0.5) * slot_width
+
+            if show_labels:
+                qbit_text = format(q_idx, f'0{qbit_num}b')
+                text = RenderText(self.App.baseFont, f"|{qbit_text}⟩", COLOR.BASETEXT)
+                text_rect = text.get_rect(center=(x, self.rect.bottom - self.baseline_margin / 2))
+                self.Screen.blit(text, text_rect)
+
+            graph_height = graph_max_height * float(prob)
+            graph_top = self.rect.top + graph_max_height - graph_height
+            graph_left = x - width / 2
+
+            pygame.draw.rect(self.Screen, COLOR.GRAPHBLUE, Rect(graph_left, graph_top, width, graph_height))
+
+    def DrawBinned(self, stats, baseline_x_min, baseline_width, graph_max_height):
+        binned = stats.GetBinned(int(baseline_width), self.bin_mode, self.App.shots)
+        baseline_y = self.rect.top + graph_max_height
+        for x_idx in np.flatnonzero(binned):
+            # at least one pixel, so the support of the distribution stays visible
+            graph_height = max(1, graph_max_height * float(binned[x_idx]))
+            x = baseline_x_min + x_idx
+            pygame.draw.line(self.Screen, COLOR.GRAPHBLUE, (x, baseline_y - graph_height), (x, baseline_y - 1))
+
+        qbit_num = stats.qbit_num
+        label_y = self.rect.bottom - self.baseline_margin / 2
+        text = RenderText(self.App.baseFont, f"|{'0' * qbit_num}⟩", COLOR.BASETEXT)
+        self.Screen.blit(text, text.get_rect(midleft=(baseline_x_min, label_y)))
+        text = RenderText(self.App.baseFont, f"|{'1' * qbit_num}⟩", COLOR.BASETEXT)
+        self.Screen.blit(text, text.get_rect(midright=(baseline_x_min + baseline_width, label_y)))
+
+    def DrawTopList(self, stats, x):
+        qbit_num = stats.qbit_num
+        y = self.rect.top + 5
+        for q_idx, prob in zip(*stats.GetTop(self.top_k, self.App.shots)):
+            if prob == 0:
+                break
+            text = RenderText(self.App.baseFont, f"|{q_idx:0{qbit_num}b}⟩ {prob:.4f}", COLOR.RESULTTEXT)
+            self.Screen.blit(text, (x, y))
+            y += text.get_height()
+
+    def DrawBloch(self, stats, baseline_x_min, baseline_width, graph_max_height, note = ""):
+        # one column per qubit, x y z bars up or down from the middle line; length 1 fills half the graph
+        bloch = stats.GetBlochVectors()
+        if len(bloch) == 0:
+            return
+        half_height = (graph_max_height - self.bloch_header) / 2 - 2
+        mid_y = self.rect.top + self.bloch_header + 2 + half_height
+        pygame.draw.line(self.Screen, COLOR.BASELINE,
+                         (baseline_x_min, mid_y),
+                         (baseline_x_min + baseline_width, mid_y),
+                         1)
+        slot_width = baseline_width / len(bloch)
+        width = min(self.graph_width, max(1, (slot_width - 2) / 3))
+        show_labels = self.App.baseFont.size(f"q{len(bloch) - 1}")[0] <= slot_width
+        for q_idx, vector in enumerate(bloch):
+            x = baseline_x_min + (q_idx + 0.5) * slot_width
+            for axis_idx, value in enumerate(vector):
+                graph_height = half_height * float(value)
+                graph_left = x + (axis_idx - 1.5) * width
+                pygame.draw.rect(self.Screen, self.bloch_colors[axis_idx],
+                                 Rect(graph_left, mid_y - max(0, graph_height), width, abs(graph_height)))
+
+            if show_labels:
+                text = RenderText(self.App.baseFont, f"q{q_idx}", COLOR.BASETEXT)
+                text_rect = text.get_rect(center=(x, self.rect.bottom - self.baseline_margin / 2))
+                self.Screen.blit(text, text_rect)
+
+        x = baseline_x_min
+        for name, color in zip("xyz", self.bloch_colors):
+            text = RenderText(self.App.baseFont, name, color)
+            self.Screen.blit(text, (x, self.rect.top + 2))
+            x += text.get_width() + 5
+        if note != "":
+            self.Screen.blit(RenderText(self.App.baseFont, note, COLOR.BASETEXT), (x + 10, self.rect.top + 2))
+
+    def GetRenderState(self):
+        return (self.App.result_version, self.App.worker.IsComputing(), self.App.shots,
+                self.App.graph_mode, self.CM.GetQbitNum(self.App.seleted_pack_key))
+
     def Draw(self):
         baseline_x_min = self.rect.left + self.baseline_margin
         baseline_x_max = self.rect.right - self.baseline_margin
         baseline_width = baseline_x_max - baseline_x_min
         baseline_y = self.rect.bottom - self.baseline_margin
         graph_max_height = self.rect.height - self.baseline_margin
+        stats = self.App.result_stats
+        if isinstance(stats, MPSState):
+            # 2^n outcomes are out of reach, the per-qubit reduced states are not
+            self.DrawBloch(stats, baseline_x_min, baseline_width, graph_max_height,
+                           f"MPS, truncation error {stats.truncation_error:.1e}")
+            self.DrawComputing()
+            return
+        if self.App.graph_mode == "bloch":
+            self.DrawBloch(stats, baseline_x_min, baseline_width, graph_max_height)
+            self.DrawComputing()
+            return
+
         pygame.draw.line(self.Screen, COLOR.BASELINE, 
                          (baseline_x_min, baseline_y), 
                          (baseline_x_max, baseline_y),
                          2)
-        for q_idx, value in enumerate(self.App.result):
-            prob = value * value.conjugate()
-            x = baseline_x_min + (q_idx + 0.5) * (baseline_width / len(self.App.result))
-            
-            qbit_text = format(q_idx, f'0{self.CM.GetQbitNum(self.App.seleted_pack_key)}b')
-            text = self.App.baseFont.render(f"|{qbit_text}⟩", True, COLOR.BASETEXT)  # Text rendering
-            text_rect = text.get_rect(center=(x, self.rect.bottom - self.baseline_margin / 2))
+        if len(stats) <= baseline_width / self.min_slot_width:
+            self.DrawBars(stats, baseline_x_min, baseline_width, graph_max_height)
+        else:
+            # too many outcomes for one bar each
+            self.DrawBinned(stats, baseline_x_min, baseline_width, graph_max_height)
+            self.DrawTopList(stats, baseline_x_min)
+
+        if self.App.shots > 0:
+            # bars are observed frequencies, not exact probabilities
+            text = RenderText(self.App.baseFont, f"{self.App.shots} shots", COLOR.BASETEXT)
+            text_rect = text.get_rect(topright=(self.rect.right - self.baseline_margin, self.rect.top + 25))
             self.Screen.blit(text, text_rect)
-            
-            graph_height = graph_max_height * prob.real[0]
-            graph_top = self.rect.top + graph_max_height - graph_height
-            graph_left = x - self.graph_width / 2
+        self.DrawComputing()
+
+    def DrawComputing(self):
+        if self.App.worker.IsComputing():
+            text = RenderText(self.App.baseFont, "computing...", COLOR.BASETEXT)
+            text_rect = text.get_rect(topright=(self.rect.right - self.baseline_margin, self.rect.top + 5))
+            self.Screen.blit(text, text_rect)
+
+class ProfilerOverlayUI(BaseUI):
+    """Frame and simulation timings; F3 shows it, F4 exports everything collected so far."""
+    line_height = 16
 
-            pygame.draw.rect(self.Screen, COLOR.GRAPHBLUE, Rect(graph_left, graph_top, self.graph_width, graph_height))
\ No newline at end of file
+    def __init__(self, app):
+        super().__init__(app, Rect(CONFIG.SCREEN_WIDTH - 185, CONFIG.BUTTONSECTIONHEIGHT + 5, 180, 5 * self.line_height + 8))
+        self.visible = False
+
+    def Update(self, event: Event):
+        if event.type != pygame.KEYDOWN:
+            return
+        if event.key == pygame.K_F3:
+            self.visible = not self.visible
+            # collect only while someone looks, unless main.py --profile asked for everything
+            PROFILER.enabled = self.visible or self.App.profile_path != ""
+        elif event.key == pygame.K_F4 and PROFILER.enabled:
+            self.App.ExportProfile()
+
+    def GetLines(self) -> list[str]:
+        ms = lambda name: f"{PROFILER.GetLast(name) * 1000:.1f} ms"
+        counters = PROFILER.ToDict()["counters"]
+        hits = sum(n for name, n in counters.items() if name.startswith("cache.") and name.endswith(".hit"))
+        misses = sum(n for name, n in counters.items() if name.startswith("cache.") and name.endswith(".miss"))
+        return [f"frame  {ms('frame.total')}",
+                f"update {ms('frame.update')} (idle {ms('frame.idle')})",
+                f"draw   {ms('frame.draw')}",
+                f"sim    {ms('sim.total')}",
+                f"cache  {hits} hit / {misses} miss"]
+
+    def GetRenderState(self):
+        return tuple(self.GetLines()) if self.visible else None
+
+    def GetDirtyRect(self) -> Rect | None:
+        return self.rect if self.visible else None
+
+    def Draw(self):
+        if not self.visible:
+            return
+        pygame.draw.rect(self.Screen, COLOR.TEXT, self.rect)
+        pygame.draw.rect(self.Screen, COLOR.BASELINE, self.rect, 1)
+        for i, line in enumerate(self.GetLines()):
+            text = RenderText(self.App.baseFont, line, COLOR.RESULTTEXT)
+            self.Screen.blit(text, (self.rect.left + 6, self.rect.top + 4 + i * self.line_height))